@@ -1,85 +1,209 @@
 # --- app.py ---
+# Thin Streamlit client: all retrieval and LLM work happens in the FastAPI backend,
+# so this process never loads embedding models or the vector store.
 import streamlit as st
-from backend.core import get_pizza_answer
 import os
+import json
+import time
 import logging
+import threading
 import requests
+from collections import OrderedDict
+from requests.adapters import HTTPAdapter
 
 
-
-os.environ["TOKENIZERS_PARALLELISM"] = "false"
-os.environ["PYTORCH_NO_CUDA_MEMORY_CACHING"] = "1"
+# --- Configuration ---
+API_URL = os.getenv("PIZZA_API_URL", "http://localhost:8000")
+REQUEST_TIMEOUT_S = 20
+HTTP_POOL_SIZE = 10  # Keep-alive connections shared by all sessions
+RESULT_CACHE_ENTRIES = 100  # Recent question/answer results kept in memory
+RESULT_CACHE_TTL_S = 600  # Results older than this are fetched again
 
 logging.getLogger("streamlit").setLevel(logging.WARNING)
 
 
+class ResultCache:
+    """Bounded LRU of recent results, shared across sessions and reruns."""
+
+    def __init__(self, max_entries: int, ttl_s: float):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            stored_at, result = item
+            if time.monotonic() - stored_at > self.ttl_s:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return result
+
+    def put(self, key, result: dict):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+@st.cache_resource
+def get_session() -> requests.Session:
+    """One pooled keep-alive HTTP session for the whole app, instead of a connection per submit."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+@st.cache_resource
+def get_result_cache() -> ResultCache:
+    return ResultCache(RESULT_CACHE_ENTRIES, RESULT_CACHE_TTL_S)
+
+
+def cache_key(question: str, use_cloud: bool) -> tuple:
+    return (" ".join(question.lower().split()), use_cloud)
+
+
+def raise_for_api_error(response: requests.Response):
+    """Turn an API error into a readable exception, including overload retry hints."""
+    if response.status_code == 200:
+        return
+    try:
+        detail = response.json().get("detail", "Unknown error")
+    except ValueError:
+        detail = response.text or "Unknown error"
+    if response.status_code == 429:
+        retry_after = response.headers.get("Retry-After", "a few")
+        raise Exception(f"The pizza oracle is busy right now, please try again in {retry_after} seconds ({detail})")
+    raise Exception(detail)
+
+
+def fetch_answer(question: str, use_cloud: bool) -> dict:
+    """Ask the backend for the complete answer in one response."""
+    response = get_session().post(
+        f"{API_URL}/ask-pizza",
+        json={"question": question, "use_cloud_llm": use_cloud},
+        timeout=REQUEST_TIMEOUT_S
+    )
+    raise_for_api_error(response)
+    return response.json()
+
+
+def stream_answer(question: str, use_cloud: bool, on_text) -> dict:
+    """Ask the backend for a streamed answer, calling on_text with the answer so far."""
+    response = get_session().post(
+        f"{API_URL}/ask-pizza/stream",
+        json={"question": question, "use_cloud_llm": use_cloud},
+        timeout=REQUEST_TIMEOUT_S,
+        stream=True
+    )
+    with response:
+        raise_for_api_error(response)
+        answer, sources = "", []
+        for line in response.iter_lines():
+            if not line:
+                continue
+            event = json.loads(line)
+            if event["type"] == "sources":
+                sources = event["sources"]
+            elif event["type"] == "token":
+                answer += event["text"]
+                on_text(answer)
+            elif event["type"] == "error":
+                raise Exception(event["detail"])
+    return {"answer": answer, "sources": sources}
+
+
+def answer_html(answer: str) -> str:
+    return f"""
+    <div style="background-color:#d4edda; padding:20px; border-radius:10px;">
+        <strong>Answer:</strong> {answer}
+    </div>
+    """
+
+
 # --- Page Setup ---
 st.set_page_config(page_title="🍕 Israeli Pizza Recommender", layout="centered")
 st.title("🍕 Ask Me About Pizza in Israel!")
 
 # --- LLM Toggle ---
 use_cloud = st.sidebar.checkbox("Use Fireworks AI (cloud LLM)", value=False)
+stream = st.sidebar.checkbox("Stream answers", value=True)
 
 # --- Question Input ---
 with st.form("pizza_query_form", clear_on_submit=False):
     question = st.text_input("What's your pizza craving today?")
     submit = st.form_submit_button("🔥 Get Recommendation")
 
-
-
-# --- On Submit ---
-if submit and question:
-    with st.spinner("Thinking about your perfect slice..."):
-        try:
-            # 🔁 Call your FastAPI backend
-            response = requests.post(
-                "http://localhost:8000/ask-pizza",
-                json={"question": question, "use_cloud_llm": use_cloud},
-                timeout=20
-            )
-
-            if response.status_code != 200:
-                raise Exception(response.json().get("detail", "Unknown error"))
-
-            result = response.json()
-            answer = result["answer"]
-            docs = result["sources"]  # Now just plain strings
-
-            # ✅ Show answer
-            st.success("Here's what we found!")
-            st.markdown(
-                "_🧠 Using: **Local LLaMA 3.2**_" if not use_cloud else "_☁️ Using: **Fireworks Cloud LLM**_"
-            )
-
-            st.markdown(
-                f"""
-                <div style="background-color:#d4edda; padding:20px; border-radius:10px;">
-                    <strong>Answer:</strong> {answer}
-                </div>
-                """,
-                unsafe_allow_html=True
-            )
-
-            # 📚 Show source reviews (now plain dicts)
-            if docs:
-                with st.expander("📖 Show the reviews we used"):
-                    for i, doc in enumerate(docs):
-                        restaurant = doc.get("restaurant", "Unknown Restaurant")
-                        city = doc.get("city", "Unknown City")
-                        rating = doc.get("rating", "N/A")
-                        date = doc.get("date", "Unknown Date")
-                        review = doc.get("review", "No review content")
-
-                        st.markdown(f"""
-                        **🍕 Review {i+1}: {restaurant} in {city}**  
-                        ⭐ Rating: {rating} | 🗓 Date: {date}  
-
-                        **Review:**  
-                        {review}
-
-                        ---
-                        """)
-
-
-        except Exception as e:
-            st.error(f"An error occurred: {str(e)}")
+# Keep showing the last answer on reruns (widget changes); only a submit asks the backend
+submitted = bool(submit and question)
+if submitted:
+    st.session_state["last_query"] = (question, use_cloud)
+elif "last_query" in st.session_state and get_result_cache().get(cache_key(*st.session_state["last_query"])) is None:
+    # The result expired from the cache since the last submit; wait for the next one
+    del st.session_state["last_query"]
+
+
+# --- On Submit / Rerun ---
+if "last_query" in st.session_state:
+    question, query_use_cloud = st.session_state["last_query"]
+    results = get_result_cache()
+    key = cache_key(question, query_use_cloud)
+
+    try:
+        st.markdown(
+            "_🧠 Using: **Local LLaMA 3.2**_" if not query_use_cloud else "_☁️ Using: **Fireworks Cloud LLM**_"
+        )
+        answer_box = st.empty()
+
+        result = results.get(key)
+        if result is None:
+            if stream:
+                with st.spinner("Thinking about your perfect slice..."):
+                    result = stream_answer(
+                        question,
+                        query_use_cloud,
+                        lambda text: answer_box.markdown(answer_html(text), unsafe_allow_html=True)
+                    )
+            else:
+                with st.spinner("Thinking about your perfect slice..."):
+                    result = fetch_answer(question, query_use_cloud)
+            results.put(key, result)
+
+        answer = result["answer"]
+        docs = result.get("sources") or []
+
+        # ✅ Show answer
+        answer_box.markdown(answer_html(answer), unsafe_allow_html=True)
+        st.success("Here's what we found!")
+
+        # 📚 Show source reviews (now plain dicts)
+        if docs:
+            with st.expander("📖 Show the reviews we used"):
+                for i, doc in enumerate(docs):
+                    restaurant = doc.get("restaurant", "Unknown Restaurant")
+                    city = doc.get("city", "Unknown City")
+                    rating = doc.get("rating", "N/A")
+                    date = doc.get("date", "Unknown Date")
+                    review = doc.get("review", "No review content")
+
+                    st.markdown(f"""
+                    **🍕 Review {i+1}: {restaurant} in {city}**  
+                    ⭐ Rating: {rating} | 🗓 Date: {date}  
+
+                    **Review:**  
+                    {review}
+
+                    ---
+                    """)
+
+    except Exception as e:
+        # Failed results are not cached; forget the query so reruns do not resend it
+        st.session_state.pop("last_query", None)
+        st.error(f"An error occurred: {str(e)}")
@@ -0,0 +1,228 @@
+"""
+LLM Admission Control
+=====================
+
+Limits how many requests run the LLM stages of `get_pizza_answer` at once, per
+backend, so a traffic spike degrades into fast 429s instead of every request
+queueing inside the LLM client until the UI times out.
+
+Each backend ("local" Ollama, "cloud" Together) has:
+- A concurrency limit (requests holding an LLM slot)
+- A bounded wait queue; when it is full, new requests are rejected immediately
+- A queue deadline; requests that wait longer are rejected
+
+Cache hits never pass through here, so they are never queued behind misses.
+Keep the per-backend limits (concurrency + queue) below the API worker thread
+pool (40 threads by default) so waiting misses cannot starve cache hits of threads.
+
+Usage:
+    from backend.admission import admit, OverloadedError
+
+    try:
+        with admit("local"):
+            answer = chain.invoke(...)
+    except OverloadedError as e:
+        # respond 429 with Retry-After: e.retry_after_s
+
+    # From a coroutine; queued waits happen off the event loop
+    async with admit_async("cloud"):
+        answer = await chain.ainvoke(...)
+"""
+
+import asyncio
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass, asdict
+from typing import Dict, List
+from logger_config import setup_logger
+
+# --- Configuration ---
+LOCAL_MAX_CONCURRENCY = int(os.getenv("LOCAL_LLM_MAX_CONCURRENCY", 2))  # Ollama serves few requests in parallel
+LOCAL_MAX_QUEUE_DEPTH = int(os.getenv("LOCAL_LLM_MAX_QUEUE", 8))
+CLOUD_MAX_CONCURRENCY = int(os.getenv("CLOUD_LLM_MAX_CONCURRENCY", 8))
+CLOUD_MAX_QUEUE_DEPTH = int(os.getenv("CLOUD_LLM_MAX_QUEUE", 16))
+QUEUE_TIMEOUT_S = float(os.getenv("LLM_QUEUE_TIMEOUT_S", 10))  # Stays under the UI's 20s request timeout
+SERVICE_TIME_SMOOTHING = 0.2  # EWMA weight of the newest LLM stage duration
+
+# --- Setup ---
+logger = setup_logger(name="admission", log_file="logs/admission.log")
+
+class OverloadedError(Exception):
+    """Raised when a request cannot be admitted to an LLM backend."""
+
+    def __init__(self, backend: str, reason: str, retry_after_s: int):
+        super().__init__(f"{backend} LLM is overloaded ({reason}), retry in {retry_after_s}s")
+        self.backend = backend
+        self.reason = reason
+        self.retry_after_s = retry_after_s
+
+@dataclass
+class AdmissionStats:
+    backend: str
+    max_concurrency: int
+    max_queue_depth: int
+    in_flight: int
+    queue_depth: int
+    admitted: int
+    rejected_queue_full: int
+    rejected_timeout: int
+    avg_wait_ms: float
+    max_wait_ms: float
+    avg_service_ms: float
+
+class AdmissionController:
+    def __init__(self, backend: str, max_concurrency: int, max_queue_depth: int, queue_timeout_s: float):
+        self.backend = backend
+        self.max_concurrency = max_concurrency
+        self.max_queue_depth = max_queue_depth
+        self.queue_timeout_s = queue_timeout_s
+
+        self._slots = threading.Semaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._waiting = 0
+        self._admitted = 0
+        self._rejected_queue_full = 0
+        self._rejected_timeout = 0
+        self._total_wait_s = 0.0
+        self._max_wait_s = 0.0
+        self._avg_service_s = 0.0
+
+    def retry_after_s(self) -> int:
+        """Estimate how long until a queued request would get a slot."""
+        with self._lock:
+            backlog = self._waiting + 1
+            service_s = self._avg_service_s or 1.0
+        return max(1, math.ceil(service_s * backlog / self.max_concurrency))
+
+    def _reject(self, reason: str):
+        retry_after = self.retry_after_s()
+        logger.warning(f"🚦 Rejecting {self.backend} LLM request: {reason} (retry after {retry_after}s)")
+        raise OverloadedError(self.backend, reason, retry_after)
+
+    def _acquire(self) -> float:
+        """Take an LLM slot, waiting in the bounded queue if needed. Returns seconds waited."""
+        start = time.monotonic()
+        if self._slots.acquire(blocking=False):
+            return 0.0
+
+        with self._lock:
+            if self._waiting >= self.max_queue_depth:
+                self._rejected_queue_full += 1
+                queue_full = True
+            else:
+                self._waiting += 1
+                queue_full = False
+        if queue_full:
+            self._reject("queue full")
+
+        try:
+            acquired = self._slots.acquire(timeout=self.queue_timeout_s)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+        if not acquired:
+            with self._lock:
+                self._rejected_timeout += 1
+            self._reject("queue deadline exceeded")
+        return time.monotonic() - start
+
+    @contextmanager
+    def _hold(self, waited: float):
+        """Account for an acquired slot and release it when the block exits."""
+        with self._lock:
+            self._in_flight += 1
+            self._admitted += 1
+            self._total_wait_s += waited
+            self._max_wait_s = max(self._max_wait_s, waited)
+        if waited:
+            logger.info(f"⏳ Waited {waited * 1000:.0f}ms for a {self.backend} LLM slot")
+
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            service_s = time.monotonic() - start
+            with self._lock:
+                self._in_flight -= 1
+                if self._avg_service_s:
+                    self._avg_service_s += SERVICE_TIME_SMOOTHING * (service_s - self._avg_service_s)
+                else:
+                    self._avg_service_s = service_s
+            self._slots.release()
+
+    @contextmanager
+    def admit(self):
+        """Hold an LLM slot for the duration of the block, or raise OverloadedError."""
+        with self._hold(self._acquire()):
+            yield
+
+    @asynccontextmanager
+    async def admit_async(self):
+        """Async admit(): queued waits block a waiter thread instead of the event loop."""
+        if self._slots.acquire(blocking=False):
+            waited = 0.0
+        else:
+            acquisition = _waiters.submit(self._acquire)
+            try:
+                waited = await asyncio.wrap_future(acquisition)
+            except asyncio.CancelledError:
+                # Cancelled while queued: hand the slot back if the wait still gets one
+                acquisition.add_done_callback(
+                    lambda f: f.cancelled() or f.exception() is not None or self._slots.release()
+                )
+                raise
+        with self._hold(waited):
+            yield
+
+    def stats(self) -> AdmissionStats:
+        """Snapshot of queue depth, wait times and rejection counts."""
+        with self._lock:
+            return AdmissionStats(
+                backend=self.backend,
+                max_concurrency=self.max_concurrency,
+                max_queue_depth=self.max_queue_depth,
+                in_flight=self._in_flight,
+                queue_depth=self._waiting,
+                admitted=self._admitted,
+                rejected_queue_full=self._rejected_queue_full,
+                rejected_timeout=self._rejected_timeout,
+                avg_wait_ms=(self._total_wait_s / self._admitted * 1000) if self._admitted else 0.0,
+                max_wait_ms=self._max_wait_s * 1000,
+                avg_service_ms=self._avg_service_s * 1000,
+            )
+
+# --- Shared controllers, one per LLM backend ---
+_controllers: Dict[str, AdmissionController] = {
+    "local": AdmissionController("local", LOCAL_MAX_CONCURRENCY, LOCAL_MAX_QUEUE_DEPTH, QUEUE_TIMEOUT_S),
+    "cloud": AdmissionController("cloud", CLOUD_MAX_CONCURRENCY, CLOUD_MAX_QUEUE_DEPTH, QUEUE_TIMEOUT_S),
+}
+
+def backend_name(use_cloud_llm: bool) -> str:
+    """Map the use_cloud_llm toggle to an admission backend name."""
+    return "cloud" if use_cloud_llm else "local"
+
+def admit(backend: str):
+    """Context manager holding an LLM slot on the given backend."""
+    return _controllers[backend].admit()
+
+def admit_async(backend: str):
+    """Async context manager holding an LLM slot on the given backend."""
+    return _controllers[backend].admit_async()
+
+def total_capacity() -> int:
+    """Requests that can hold or wait for an LLM slot at once, across all backends."""
+    return sum(c.max_concurrency + c.max_queue_depth for c in _controllers.values())
+
+# Threads that block in the admission queue for admit_async. Sized to total capacity
+# so queued waits never queue again behind each other in this pool.
+_waiters = ThreadPoolExecutor(max_workers=total_capacity(), thread_name_prefix="admission-wait")
+
+def get_admission_stats() -> List[dict]:
+    """Admission stats for every backend, as plain dicts."""
+    return [asdict(controller.stats()) for controller in _controllers.values()]
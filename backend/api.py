@@ -1,18 +1,56 @@
 # --- api.py ---
-from fastapi import FastAPI, HTTPException, Depends, Security
+from fastapi import FastAPI, HTTPException, Depends, Security, Request
 from fastapi.security import APIKeyHeader
+from fastapi.responses import ORJSONResponse, FileResponse, StreamingResponse
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
+from contextlib import nullcontext
+from dataclasses import asdict
 from datetime import datetime
-from typing import List
-from backend.core import get_pizza_answer
+from typing import List, Literal, Optional
+from backend.core import get_pizza_answer, stream_pizza_answer
 from backend.cache import get_cache_stats, get_cached_entries
+from backend.cache_warmer import start_scheduled_warmup
+from backend.cache_compaction import compact_cache, start_scheduled_compaction
+from backend.admission import OverloadedError, get_admission_stats
+from backend.llm_router import get_routing_stats
+from backend.embedding_batcher import get_embedding_stats
+from backend import profiling
+import itertools
+import orjson
 import uvicorn
+import time
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
-app = FastAPI()
+GZIP_MIN_BYTES = 1000  # Responses smaller than this are not worth compressing
+GZIP_EXCLUDED_PATHS = {"/ask-pizza/stream"}  # gzip buffers chunks, which would defeat streaming
+
+class SelectiveGZipMiddleware(GZipMiddleware):
+    """GZipMiddleware that leaves streaming routes uncompressed."""
+
+    def __init__(self, app, excluded_paths: set, **kwargs):
+        super().__init__(app, **kwargs)
+        self.excluded_paths = excluded_paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in self.excluded_paths:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+app = FastAPI(default_response_class=ORJSONResponse)
+app.add_middleware(SelectiveGZipMiddleware, excluded_paths=GZIP_EXCLUDED_PATHS, minimum_size=GZIP_MIN_BYTES)
+
+@app.on_event("startup")
+def start_background_jobs():
+    """Start optional background jobs (enabled via environment variables)."""
+    if os.getenv("CACHE_WARMUP_ENABLED", "false").lower() == "true":
+        start_scheduled_warmup()
+    if os.getenv("CACHE_COMPACTION_ENABLED", "false").lower() == "true":
+        start_scheduled_compaction()
 
 # -------------------------------
 # 🔐 Security Configuration
@@ -37,10 +75,12 @@ async def get_api_key(api_key_header: str = Security(api_key_header)) -> str:
 class PizzaRequest(BaseModel):
     question: str
     use_cloud_llm: bool = False
+    # "answer": answer only, "summary": restaurant/city/rating per source, "full": sources with review text
+    fields: Literal["answer", "summary", "full"] = "full"
 
 class PizzaResponse(BaseModel):
     answer: str
-    sources: list[dict]  # each source is a dict with restaurant, city, etc.
+    sources: Optional[list[dict]] = None  # each source is a dict with restaurant, city, etc.
 
 class CacheStatsRequest(BaseModel):
     hours: int = 24
@@ -56,12 +96,112 @@ class CachedEntry(BaseModel):
 class CachedEntriesResponse(BaseModel):
     entries: List[CachedEntry]
 
+class CompactionRequest(BaseModel):
+    threshold: Optional[float] = None  # Defaults to CACHE_COMPACTION_THRESHOLD
+
+class CompactionResponse(BaseModel):
+    entries_before: int
+    entries_after: int
+    clusters_merged: int
+    entries_merged: int
+    threshold: float
+    duration_s: float
+
+class BackendAdmissionStats(BaseModel):
+    backend: str
+    max_concurrency: int
+    max_queue_depth: int
+    in_flight: int
+    queue_depth: int
+    admitted: int
+    rejected_queue_full: int
+    rejected_timeout: int
+    avg_wait_ms: float
+    max_wait_ms: float
+    avg_service_ms: float
+
+class BackendRoutingStats(BaseModel):
+    backend: str
+    calls: int
+    errors: int
+    error_rate: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    hedges_sent: int
+    hedge_wins: int
+
+class EmbeddingBatchStats(BaseModel):
+    model: str
+    max_batch_size: int
+    max_wait_ms: float
+    batches: int
+    texts: int
+    avg_batch_size: float
+    largest_batch: int
+    avg_queue_wait_ms: float
+    avg_forward_ms: float
+
+class EmbeddingStatsResponse(BaseModel):
+    models: List[EmbeddingBatchStats]
+
+class ProfilingRequest(BaseModel):
+    requests: int = 1  # Number of /ask-pizza requests to profile
+    header_name: Optional[str] = None  # Only profile requests carrying this header...
+    header_value: Optional[str] = None  # ...optionally with this exact value
+    allocations: bool = False  # Also capture a tracemalloc allocation snapshot
+
+class ProfilingStatusResponse(BaseModel):
+    enabled: bool
+    remaining_requests: int
+    header_name: Optional[str]
+    header_value: Optional[str]
+    allocations: bool
+
+class ProfileSummary(BaseModel):
+    id: str
+    label: str
+    started_at: datetime
+    duration_ms: float
+    samples: int
+
+class ProfileReportsResponse(BaseModel):
+    reports: List[ProfileSummary]
+
+class LLMStatsResponse(BaseModel):
+    backends: List[BackendAdmissionStats]
+    routing: List[BackendRoutingStats]  # Populated when LLM_MODE=auto
+
 # -------------------------------
 # 🔁 API Routes
 # -------------------------------
 
+def _serialize_sources(docs: list, fields: str) -> Optional[list[dict]]:
+    """Convert LangChain documents to dicts (for JSON-safe response), trimmed to the requested fields."""
+    if fields == "summary":
+        return [
+            {
+                "restaurant": doc.metadata.get("restaurant", "N/A"),
+                "city": doc.metadata.get("city", "N/A"),
+                "rating": doc.metadata.get("rating", "N/A")
+            }
+            for doc in docs
+        ]
+    if fields == "full":
+        return [
+            {
+                "restaurant": doc.metadata.get("restaurant", "N/A"),
+                "city": doc.metadata.get("city", "N/A"),
+                "rating": doc.metadata.get("rating", "N/A"),
+                "date": doc.metadata.get("date", "N/A"),
+                "review": doc.page_content
+            }
+            for doc in docs
+        ]
+    return None
+
 @app.post("/ask-pizza", response_model=PizzaResponse)
-def ask_pizza(req: PizzaRequest):
+def ask_pizza(req: PizzaRequest, request: Request):
     """
     POST /ask-pizza
     Generate an AI-powered pizza recommendation based on user input.
@@ -69,29 +209,92 @@ def ask_pizza(req: PizzaRequest):
     Params:
     - question: The user's pizza-related query
     - use_cloud_llm: Toggle whether to use a cloud LLM
+    - fields: "answer" (no sources), "summary" (restaurant, city, rating) or "full" (default)
 
     Returns:
-    - An answer string and a list of source reviews used in the response
+    - An answer string and, unless fields="answer", the source reviews used in the response
+    - 429 with a Retry-After header when the LLM backend is overloaded
+
+    Responses are encoded with orjson (serialization time in the Server-Timing
+    header) and gzip-compressed above 1KB when the client accepts it.
     """
     try:
-        answer, docs = get_pizza_answer(req.question, use_cloud_llm=req.use_cloud_llm)
+        # Sampling profiler, only when armed through /profiling
+        profiler = profiling.profile_request("ask-pizza") if profiling.should_profile(request.headers) else nullcontext()
+        with profiler:
+            answer, docs = get_pizza_answer(req.question, use_cloud_llm=req.use_cloud_llm)
 
-        # Convert LangChain documents to dicts (for JSON-safe response)
-        sources = []
-        for doc in docs:
-            sources.append({
-                "restaurant": doc.metadata.get("restaurant", "N/A"),
-                "city": doc.metadata.get("city", "N/A"),
-                "rating": doc.metadata.get("rating", "N/A"),
-                "date": doc.metadata.get("date", "N/A"),
-                "review": doc.page_content
-            })
+        content = {"answer": answer}
+        sources = _serialize_sources(docs, req.fields)
+        if sources is not None:
+            content["sources"] = sources
 
-        return PizzaResponse(answer=answer, sources=sources)
+        # Returned directly, so FastAPI skips re-validating through PizzaResponse
+        start = time.perf_counter()
+        response = ORJSONResponse(content)
+        response.headers["Server-Timing"] = f"serialize;dur={(time.perf_counter() - start) * 1000:.2f}"
+        return response
 
+    except OverloadedError as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after_s)}
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/ask-pizza/stream")
+def ask_pizza_stream(req: PizzaRequest, request: Request):
+    """
+    POST /ask-pizza/stream
+    Same as /ask-pizza, but streams the answer as newline-delimited JSON events:
+
+    - {"type": "sources", "sources": [...]} once retrieval is done (omitted when fields="answer")
+    - {"type": "token", "text": "..."} for each answer chunk
+    - {"type": "error", "detail": "..."} if generation fails midway
+    - {"type": "done"} at the end
+
+    Returns 429 with a Retry-After header when the LLM backend is overloaded.
+    This route is never gzip-compressed, so chunks reach the client as they are generated.
+    """
+    events = stream_pizza_answer(req.question, use_cloud_llm=req.use_cloud_llm)
+    if profiling.should_profile(request.headers):
+        # Covers the whole stream, not just the steps run before the response starts
+        events = profiling.profile_stream("ask-pizza-stream", events)
+    try:
+        # Run up to retrieval before responding, so overload still maps to a 429
+        first = next(events)
+    except OverloadedError as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after_s)}
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    def ndjson():
+        try:
+            for kind, value in itertools.chain([first], events):
+                if kind == "sources":
+                    sources = _serialize_sources(value, req.fields)
+                    if sources is None:
+                        continue
+                    event = {"type": "sources", "sources": sources}
+                else:
+                    event = {"type": "token", "text": value}
+                yield orjson.dumps(event) + b"\n"
+        except Exception as e:
+            yield orjson.dumps({"type": "error", "detail": str(e)}) + b"\n"
+            return
+        finally:
+            # A client disconnect closes this generator; stop generation (and profiling) with it
+            events.close()
+        yield orjson.dumps({"type": "done"}) + b"\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
 @app.post("/cache-stats", response_model=CacheStatsResponse, dependencies=[Depends(get_api_key)])
 def get_stats(req: CacheStatsRequest):
     """
@@ -123,6 +326,86 @@ def get_cached_qa():
     entries = get_cached_entries()
     return {"entries": entries}
 
+@app.post("/cache-compact", response_model=CompactionResponse, dependencies=[Depends(get_api_key)])
+def compact_cached_qa(req: CompactionRequest):
+    """
+    POST /cache-compact [Admin Only]
+    Merge near-duplicate cache entries into canonical ones, keeping their
+    questions as aliases and summing their hit counts.
+    
+    Requires admin API key in X-Admin-Key header.
+
+    Params:
+    - threshold: Minimum cosine similarity to merge (optional)
+    """
+    try:
+        report = compact_cache(req.threshold) if req.threshold is not None else compact_cache()
+        return asdict(report)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/llm-stats", response_model=LLMStatsResponse, dependencies=[Depends(get_api_key)])
+def get_llm_stats():
+    """
+    GET /llm-stats [Admin Only]
+    Get LLM admission control stats per backend: slots in use, queue depth,
+    wait times and rejections, plus hedged routing latency percentiles and
+    error rates.
+    
+    Requires admin API key in X-Admin-Key header.
+    """
+    return {"backends": get_admission_stats(), "routing": get_routing_stats()}
+
+@app.get("/embedding-stats", response_model=EmbeddingStatsResponse, dependencies=[Depends(get_api_key)])
+def get_embedding_batch_stats():
+    """
+    GET /embedding-stats [Admin Only]
+    Get embedding micro-batching stats: batches run, average and largest batch
+    size, queue wait and forward pass time.
+    
+    Requires admin API key in X-Admin-Key header.
+    """
+    return {"models": get_embedding_stats()}
+
+@app.post("/profiling", response_model=ProfilingStatusResponse, dependencies=[Depends(get_api_key)])
+def start_profiling(req: ProfilingRequest):
+    """
+    POST /profiling [Admin Only]
+    Turn on sampling profiling for the next N /ask-pizza requests, or only for
+    requests carrying a given header. Each profiled request stores a report.
+    
+    Requires admin API key in X-Admin-Key header.
+    """
+    return asdict(profiling.arm(req.requests, req.header_name, req.header_value, req.allocations))
+
+@app.delete("/profiling", response_model=ProfilingStatusResponse, dependencies=[Depends(get_api_key)])
+def stop_profiling():
+    """
+    DELETE /profiling [Admin Only]
+    Turn profiling off before the armed requests are used up.
+    """
+    return asdict(profiling.disarm())
+
+@app.get("/profiling/reports", response_model=ProfileReportsResponse, dependencies=[Depends(get_api_key)])
+def get_profile_reports():
+    """
+    GET /profiling/reports [Admin Only]
+    List stored profile reports, newest first.
+    """
+    return {"reports": profiling.list_reports()}
+
+@app.get("/profiling/reports/{report_id}", dependencies=[Depends(get_api_key)])
+def download_profile_report(report_id: str, format: Literal["json", "collapsed"] = "json"):
+    """
+    GET /profiling/reports/{report_id} [Admin Only]
+    Download a profile report: "json" (top functions, allocations) or
+    "collapsed" stacks for flamegraph.pl / speedscope.
+    """
+    path = profiling.get_report_path(report_id, format)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile report not found")
+    return FileResponse(path, filename=path.name)
+
 # -------------------------------
 # 🔧 Local dev (optional)
 # -------------------------------
@@ -5,14 +5,20 @@ Pizza Query Cache
 A semantic caching system for pizza-related queries using SQLite and HuggingFace embeddings.
 
 Key Features:
+- Exact-match lookup on a normalized question hash before any embedding
 - Semantic matching using cosine similarity
 - Automatic cache cleanup and size management
+- Stale-while-revalidate serving between soft and hard TTL
 - Query filtering based on relevance
 - Hit count tracking and performance metrics
+- Sources stored as review IDs, rehydrated from a shared review table
+- Near-duplicate entries merged by compaction, keeping their questions as aliases
+- Targeted invalidation: entries depending on re-ingested restaurants or cities are marked stale
 
 Cache Rules:
 - Max entries: 1000
-- TTL: 7 days
+- Soft TTL: 5 days (served as stale, refreshed in the background)
+- Hard TTL: 7 days
 - Min query length: 4 words
 - Similarity threshold: 0.92
 
@@ -29,14 +35,18 @@ Usage:
 """
 
 from typing import Optional, Tuple, List
+from dataclasses import dataclass
 import sqlite3
+import hashlib
 import json
+import os
+import re
 import time
 import numpy as np
 from datetime import datetime, timedelta
 from pathlib import Path
 from langchain_core.documents import Document
-from langchain_huggingface import HuggingFaceEmbeddings
+from backend.embedding_batcher import get_shared_embeddings
 from logger_config import setup_logger
 from backend.cache_metrics import MetricsTracker
 
@@ -45,22 +55,124 @@ CACHE_DIR = Path("cache")
 DB_PATH = CACHE_DIR / "pizza_cache.db"
 EMBEDDING_MODEL = "BAAI/bge-small-en-v1.5"  # Same as vector.py for consistency
 SIMILARITY_THRESHOLD = 0.92  # Minimum cosine similarity to consider cache hit
-CACHE_TTL_DAYS = 7  # Cache entries expire after 7 days
+CACHE_SOFT_TTL_DAYS = 5  # After 5 days entries are served stale and refreshed in the background
+CACHE_TTL_DAYS = 7  # Cache entries expire after 7 days (hard TTL)
 MAX_CACHE_ENTRIES = 1000  # Maximum number of cached entries
 MIN_QUERY_LENGTH = 4  # Minimum number of words in query to cache
 CACHE_CLEANUP_THRESHOLD = 0.8  # When cache reaches 80% capacity, cleanup old entries
+INVALIDATION_MODE = os.getenv("CACHE_INVALIDATION_MODE", "stale")  # "stale" (serve and refresh) or "delete"
+CITY_ALIASES = {  # Expanded before hashing so "pizza in TLV" and "pizza in Tel Aviv" share an entry
+    "tlv": "tel aviv",
+    "jlm": "jerusalem",
+}
 
 # --- Setup ---
 logger = setup_logger(name="cache", log_file="logs/cache.log")
-embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+embeddings = get_shared_embeddings(EMBEDDING_MODEL)  # Shared model, micro-batched across requests
 metrics = MetricsTracker(DB_PATH)
 
+def _connect() -> sqlite3.Connection:
+    """
+    Open the cache DB with synchronous=NORMAL.
+    
+    In WAL mode this skips the fsync on every commit (hit counts, metrics), which
+    dominated exact-hit latency; a power loss can only drop the last few writes.
+    """
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def _encode_embedding(embedding: List[float]) -> bytes:
+    """Pack an embedding as float32 bytes (~4x smaller than its JSON text)."""
+    return np.asarray(embedding, dtype=np.float32).tobytes()
+
+def _decode_embedding(value) -> np.ndarray:
+    """Unpack a stored embedding; rows cached before packing hold JSON text."""
+    if isinstance(value, bytes):
+        return np.frombuffer(value, dtype=np.float32)
+    return np.array(json.loads(value), dtype=np.float32)
+
+def _source_id(doc: Document) -> str:
+    """Stable ID of a source review: its vector store review_id, or a content hash for older indexes."""
+    if doc.metadata.get("review_id"):
+        return str(doc.metadata["review_id"])
+    payload = json.dumps([doc.page_content, doc.metadata], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+def _store_sources(conn: sqlite3.Connection, sources: List[Document]) -> str:
+    """
+    Save source reviews into the shared cache_reviews table.
+    
+    Returns:
+        JSON list of review IDs to store in query_cache.sources
+    """
+    review_ids = []
+    for doc in sources:
+        review_id = _source_id(doc)
+        conn.execute(
+            "INSERT OR REPLACE INTO cache_reviews (review_id, content, metadata) VALUES (?, ?, ?)",
+            (review_id, doc.page_content, json.dumps(doc.metadata))
+        )
+        review_ids.append(review_id)
+    return json.dumps(review_ids)
+
+def _dependency_key(value) -> str:
+    """Normalize a restaurant or city name for dependency lookups."""
+    return str(value or "").strip().lower()
+
+def _store_dependencies(conn: sqlite3.Connection, entry_id: int, sources: List[Document]):
+    """Record which restaurants and cities an entry's answer was built from."""
+    conn.execute("DELETE FROM cache_dependencies WHERE entry_id = ?", (entry_id,))
+    conn.executemany(
+        "INSERT OR IGNORE INTO cache_dependencies (entry_id, restaurant, city) VALUES (?, ?, ?)",
+        [
+            (entry_id, _dependency_key(doc.metadata.get("restaurant")), _dependency_key(doc.metadata.get("city")))
+            for doc in sources
+        ]
+    )
+
+def _load_sources(conn: sqlite3.Connection, sources_json: str) -> List[Document]:
+    """Rehydrate source documents from their review IDs with a single bulk lookup."""
+    review_ids = json.loads(sources_json)
+    if not review_ids:
+        return []
+    
+    placeholders = ",".join("?" * len(review_ids))
+    rows = conn.execute(
+        f"SELECT review_id, content, metadata FROM cache_reviews WHERE review_id IN ({placeholders})",
+        review_ids
+    ).fetchall()
+    by_id = {review_id: (content, metadata) for review_id, content, metadata in rows}
+    
+    sources = []
+    for review_id in review_ids:
+        if review_id not in by_id:
+            logger.warning(f"⚠️ Cached source review {review_id} not found")
+            continue
+        content, metadata = by_id[review_id]
+        sources.append(Document(page_content=content, metadata=json.loads(metadata)))
+    return sources
+
 def cosine_similarity(a: List[float], b: List[float]) -> float:
     """Calculate cosine similarity between two vectors."""
     a = np.array(a)
     b = np.array(b)
     return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
 
+def normalize_question(question: str) -> str:
+    """
+    Normalize a question for exact-match lookup.
+    
+    Lowercases, folds punctuation and whitespace, and expands city aliases,
+    e.g. "Best pizza in TLV?" → "best pizza in tel aviv".
+    """
+    words = re.sub(r"[^\w\s]", " ", question.lower()).split()
+    return " ".join(CITY_ALIASES.get(word, word) for word in words)
+
+def question_hash(question: str) -> str:
+    """Hash of the normalized question, used as the exact-match cache key."""
+    return hashlib.sha256(normalize_question(question).encode("utf-8")).hexdigest()
+
 def should_cache_query(question: str) -> bool:
     """
     Determine if a query should be cached based on heuristics.
@@ -94,6 +206,17 @@ def should_cache_query(question: str) -> bool:
     
     return True
 
+def _prune_orphans(conn: sqlite3.Connection):
+    """Drop reviews and aliases no longer referenced by any entry."""
+    conn.execute("""
+        DELETE FROM cache_reviews 
+        WHERE review_id NOT IN (
+            SELECT DISTINCT value FROM query_cache, json_each(query_cache.sources)
+        )
+    """)
+    conn.execute("DELETE FROM cache_aliases WHERE entry_id NOT IN (SELECT id FROM query_cache)")
+    conn.execute("DELETE FROM cache_dependencies WHERE entry_id NOT IN (SELECT id FROM query_cache)")
+
 def cleanup_cache():
     """
     Remove old/unused entries when cache nears capacity.
@@ -103,7 +226,7 @@ def cleanup_cache():
     2. If still full, remove least recently used
     3. Maintains 60% of max capacity after cleanup
     """
-    with sqlite3.connect(DB_PATH) as conn:
+    with _connect() as conn:
         # Get current cache size
         count = conn.execute("SELECT COUNT(*) FROM query_cache").fetchone()[0]
         
@@ -127,6 +250,7 @@ def cleanup_cache():
                     )
                 """, (to_delete,))
             
+            _prune_orphans(conn)
             conn.commit()
             logger.info(f"✨ Cache cleaned up. New size: {conn.execute('SELECT COUNT(*) FROM query_cache').fetchone()[0]}")
 
@@ -137,7 +261,11 @@ def init_cache():
     """
     CACHE_DIR.mkdir(exist_ok=True)
     
-    with sqlite3.connect(DB_PATH) as conn:
+    with _connect() as conn:
+        # WAL keeps hit-count and metrics writes from blocking concurrent lookups.
+        # Must run before any write opens a transaction.
+        conn.execute("PRAGMA journal_mode=WAL")
+        
         # Create table if it doesn't exist
         conn.execute("""
         CREATE TABLE IF NOT EXISTS query_cache (
@@ -150,6 +278,45 @@ def init_cache():
         )
         """)
         
+        # Source reviews shared by all entries; query_cache.sources holds their IDs
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS cache_reviews (
+            review_id TEXT PRIMARY KEY,
+            content TEXT NOT NULL,
+            metadata TEXT NOT NULL
+        )
+        """)
+        
+        # Questions merged into another entry by compaction, still served by exact match
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS cache_aliases (
+            question_hash TEXT PRIMARY KEY,
+            question TEXT NOT NULL,
+            entry_id INTEGER NOT NULL
+        )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_aliases_entry_id ON cache_aliases(entry_id)")
+        
+        # Restaurants and cities each entry's sources came from, for targeted invalidation
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS cache_dependencies (
+            entry_id INTEGER NOT NULL,
+            restaurant TEXT NOT NULL,
+            city TEXT NOT NULL,
+            PRIMARY KEY (entry_id, restaurant, city)
+        )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_dependencies_restaurant ON cache_dependencies(restaurant, city)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_dependencies_city ON cache_dependencies(city)")
+        
+        # Small key/value store, e.g. the review digests the cache was last synced with
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS cache_state (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+        """)
+        
         # Check if hit_count column exists
         cursor = conn.execute("PRAGMA table_info(query_cache)")
         columns = [col[1] for col in cursor.fetchall()]
@@ -161,73 +328,212 @@ def init_cache():
             ALTER TABLE query_cache 
             ADD COLUMN hit_count INTEGER DEFAULT 1
             """)
+        
+        # Add question_hash column if it doesn't exist
+        if 'question_hash' not in columns:
+            logger.info("Adding question_hash column to cache table")
+            conn.execute("ALTER TABLE query_cache ADD COLUMN question_hash TEXT")
+        
+        # Add invalidated column if it doesn't exist
+        if 'invalidated' not in columns:
+            logger.info("Adding invalidated column to cache table")
+            conn.execute("ALTER TABLE query_cache ADD COLUMN invalidated INTEGER DEFAULT 0")
+        
+        conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_query_cache_question_hash 
+        ON query_cache(question_hash)
+        """)
+        
+        # Backfill hashes for rows cached before the column existed.
+        # Newest first, so the most recent answer wins when two rows normalize the same.
+        rows = conn.execute(
+            "SELECT id, question FROM query_cache WHERE question_hash IS NULL ORDER BY created_at DESC"
+        ).fetchall()
+        for entry_id, cached_q in rows:
+            conn.execute(
+                "UPDATE OR IGNORE query_cache SET question_hash = ? WHERE id = ?",
+                (question_hash(cached_q), entry_id)
+            )
+        
+        # Migrate rows that still hold full source copies or JSON embeddings
+        rows = conn.execute(
+            """
+            SELECT id, sources, question_embedding FROM query_cache 
+            WHERE sources LIKE '[{%' OR typeof(question_embedding) = 'text'
+            """
+        ).fetchall()
+        for entry_id, sources_json, embedding in rows:
+            sources = json.loads(sources_json)
+            if sources and isinstance(sources[0], dict):
+                docs = [Document(page_content=s["content"], metadata=s["metadata"]) for s in sources]
+                sources_json = _store_sources(conn, docs)
+            conn.execute(
+                "UPDATE query_cache SET sources = ?, question_embedding = ? WHERE id = ?",
+                (sources_json, _encode_embedding(_decode_embedding(embedding)), entry_id)
+            )
+        migrated = len(rows)
+        if migrated:
+            logger.info(f"Migrated {migrated} cache entries to review references")
+        
+        # Backfill dependencies for entries cached before they were tracked
+        conn.execute("""
+            INSERT OR IGNORE INTO cache_dependencies (entry_id, restaurant, city)
+            SELECT q.id,
+                lower(trim(coalesce(json_extract(r.metadata, '$.restaurant'), ''))),
+                lower(trim(coalesce(json_extract(r.metadata, '$.city'), '')))
+            FROM query_cache q, json_each(q.sources) s
+            JOIN cache_reviews r ON r.review_id = s.value
+            WHERE q.id NOT IN (SELECT entry_id FROM cache_dependencies)
+        """)
             
         conn.commit()
+        
+        if migrated:
+            # Rewritten rows leave their old inline sources as free pages; VACUUM
+            # (which cannot run inside a transaction) returns them to the filesystem
+            conn.execute("VACUUM")
+            # In WAL mode the compacted pages only reach the main file at a checkpoint
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            logger.info("🧹 Vacuumed cache database after migration")
     logger.info("✅ Cache database initialized")
 
-def get_cached_response(question: str) -> Optional[Tuple[str, List[Document]]]:
+@dataclass
+class CacheHit:
+    entry_id: int
+    question: str  # The cached question, which may be a paraphrase of the one asked
+    answer: str
+    sources: List[Document]
+    similarity: float
+    is_stale: bool  # Older than the soft TTL or invalidated; should be served and refreshed
+    match_type: str = "semantic"  # "exact" (question hash) or "semantic" (embedding)
+
+def _cache_expiries() -> Tuple[datetime, datetime]:
+    """Return the (hard, soft) expiry cut-offs for created_at."""
+    now = datetime.now()
+    return now - timedelta(days=CACHE_TTL_DAYS), now - timedelta(days=CACHE_SOFT_TTL_DAYS)
+
+def _find_exact_match(conn: sqlite3.Connection, q_hash: str) -> Optional[CacheHit]:
     """
-    Find semantically similar cached response.
+    Look up an unexpired entry by normalized question hash (indexed, no embedding needed).
+    
+    Questions merged away by compaction are found through their alias.
+    """
+    expiry, soft_expiry = _cache_expiries()
+    row = conn.execute(
+        """
+        SELECT id, question, answer, sources, created_at < ? OR invalidated
+        FROM query_cache 
+        WHERE (question_hash = ? OR id = (SELECT entry_id FROM cache_aliases WHERE question_hash = ?))
+            AND created_at > ?
+        ORDER BY created_at DESC
+        """,
+        (soft_expiry, q_hash, q_hash, expiry)
+    ).fetchone()
+    
+    if not row:
+        return None
+    
+    entry_id, cached_q, answer, sources_json, is_stale = row
+    sources = _load_sources(conn, sources_json)
+    return CacheHit(entry_id, cached_q, answer, sources, 1.0, bool(is_stale), match_type="exact")
+
+def _find_best_match(conn: sqlite3.Connection, question_embedding: List[float]) -> Optional[CacheHit]:
+    """
+    Scan unexpired cache entries for the most similar question.
+    
+    Returns:
+        CacheHit for the best match above the similarity threshold, or None
+    """
+    expiry, soft_expiry = _cache_expiries()
+    cursor = conn.execute(
+        """
+        SELECT id, question_embedding, created_at < ? OR invalidated
+        FROM query_cache WHERE created_at > ?
+        """,
+        (soft_expiry, expiry)
+    )
+    
+    best_match = None
+    highest_similarity = 0
+    
+    for row in cursor:
+        entry_id, embedding_bytes, is_stale = row
+        cached_embedding = _decode_embedding(embedding_bytes)
+        
+        # Calculate cosine similarity
+        similarity = cosine_similarity(question_embedding, cached_embedding)
+        
+        if similarity > highest_similarity and similarity >= SIMILARITY_THRESHOLD:
+            highest_similarity = similarity
+            best_match = (entry_id, similarity, bool(is_stale))
+    
+    if not best_match:
+        return None
+    
+    # Only the winning entry's answer and sources are loaded
+    entry_id, similarity, is_stale = best_match
+    cached_q, answer, sources_json = conn.execute(
+        "SELECT question, answer, sources FROM query_cache WHERE id = ?",
+        (entry_id,)
+    ).fetchone()
+    sources = _load_sources(conn, sources_json)
+    return CacheHit(entry_id, cached_q, answer, sources, similarity, is_stale)
+
+def _find_match(conn: sqlite3.Connection, question: str) -> Optional[CacheHit]:
+    """
+    Find the cache entry for a question: exact hash match first, then semantic search.
+    
+    The embedding model is only invoked when the exact-match lookup misses.
+    """
+    hit = _find_exact_match(conn, question_hash(question))
+    if hit:
+        return hit
+    
+    question_embedding = embeddings.embed_query(question)
+    return _find_best_match(conn, question_embedding)
+
+def lookup_cached_response(question: str) -> Optional[CacheHit]:
+    """
+    Find a cached response for a question, recording hit/miss metrics.
+    
+    Byte-identical or trivially different repeats (case, punctuation, city
+    aliases) are served from the question hash index without embedding.
+    Entries between the soft and hard TTL are still returned, flagged as stale,
+    so the caller can serve them immediately and schedule a refresh.
     
     Args:
         question: User query to find in cache
         
     Returns:
-        Tuple of (answer, sources) if similarity > 0.92
-        None if no good match found
+        CacheHit if similarity > 0.92, None if no good match found
     """
     start_time = time.time()
     
-    # Get embedding for current question
-    question_embedding = embeddings.embed_query(question)
-    
-    with sqlite3.connect(DB_PATH) as conn:
-        # Get recent cache entries
-        expiry = datetime.now() - timedelta(days=CACHE_TTL_DAYS)
-        cursor = conn.execute(
-            "SELECT id, question, answer, sources, question_embedding FROM query_cache WHERE created_at > ?",
-            (expiry,)
-        )
-        
-        best_match = None
-        highest_similarity = 0
-        best_match_id = None
-        
-        for row in cursor:
-            entry_id, cached_q, answer, sources_json, embedding_bytes = row
-            cached_embedding = json.loads(embedding_bytes)
-            
-            # Calculate cosine similarity
-            similarity = cosine_similarity(question_embedding, cached_embedding)
-            
-            if similarity > highest_similarity and similarity >= SIMILARITY_THRESHOLD:
-                highest_similarity = similarity
-                best_match = (answer, sources_json)
-                best_match_id = entry_id
+    with _connect() as conn:
+        hit = _find_match(conn, question)
         
-        if best_match:
-            answer, sources_json = best_match
-            sources = [
-                Document(page_content=s["content"], metadata=s["metadata"])
-                for s in json.loads(sources_json)
-            ]
-            
-            # Update hit count
+        if hit:
+            # Hit count and metrics row share one transaction (one commit per hit)
             conn.execute(
                 "UPDATE query_cache SET hit_count = hit_count + 1 WHERE id = ?",
-                (best_match_id,)
+                (hit.entry_id,)
             )
-            conn.commit()
-            
             time_saved = time.time() - start_time
             metrics.record_query(
                 query=question,
                 cache_hit=True,
-                similarity=highest_similarity,
-                time_saved_ms=time_saved * 1000
+                similarity=hit.similarity,
+                time_saved_ms=time_saved * 1000,
+                stale=hit.is_stale,
+                match_type=hit.match_type,
+                conn=conn
             )
-            logger.info(f"✨ Cache hit! Similarity: {highest_similarity:.3f}")
-            return answer, sources
+            conn.commit()
+            if hit.is_stale:
+                logger.info(f"♻️ Stale {hit.match_type} cache hit! Similarity: {hit.similarity:.3f}")
+            else:
+                logger.info(f"✨ {hit.match_type.capitalize()} cache hit! Similarity: {hit.similarity:.3f}")
+            return hit
     
     metrics.record_query(
         query=question,
@@ -238,6 +544,52 @@ def get_cached_response(question: str) -> Optional[Tuple[str, List[Document]]]:
     logger.info("❌ Cache miss")
     return None
 
+def get_cached_response(question: str) -> Optional[Tuple[str, List[Document]]]:
+    """
+    Find semantically similar cached response.
+    
+    Args:
+        question: User query to find in cache
+        
+    Returns:
+        Tuple of (answer, sources) if similarity > 0.92
+        None if no good match found
+    """
+    hit = lookup_cached_response(question)
+    if hit:
+        return hit.answer, hit.sources
+    return None
+
+def peek_cached_response(question: str) -> Optional[CacheHit]:
+    """
+    Find the cache entry for a question without side effects.
+    
+    Unlike lookup_cached_response, this does not record metrics or bump hit counts,
+    so it is safe to use from background jobs such as cache warming.
+    """
+    with _connect() as conn:
+        return _find_match(conn, question)
+
+def update_cached_response(entry_id: int, answer: str, sources: List[Document]):
+    """
+    Replace the answer and sources of an existing entry and reset its age.
+    
+    Used by stale-while-revalidate refreshes; hit counts are preserved.
+    """
+    with _connect() as conn:
+        sources_json = _store_sources(conn, sources)
+        conn.execute(
+            """
+            UPDATE query_cache 
+            SET answer = ?, sources = ?, created_at = CURRENT_TIMESTAMP, invalidated = 0 
+            WHERE id = ?
+            """,
+            (answer, sources_json, entry_id)
+        )
+        _store_dependencies(conn, entry_id, sources)
+        conn.commit()
+    logger.info(f"🔄 Cache entry {entry_id} refreshed")
+
 def cache_response(question: str, answer: str, sources: List[Document]):
     """
     Cache a new Q&A pair if it meets criteria.
@@ -260,33 +612,198 @@ def cache_response(question: str, answer: str, sources: List[Document]):
     # Convert question to embedding
     question_embedding = embeddings.embed_query(question)
     
-    # Convert sources to JSON-serializable format
-    sources_json = json.dumps([
-        {
-            "content": doc.page_content,
-            "metadata": doc.metadata
-        }
-        for doc in sources
-    ])
-    
-    with sqlite3.connect(DB_PATH) as conn:
+    # An expired entry for the same normalized question is replaced in place
+    with _connect() as conn:
+        # Store sources as review IDs, sharing review text across entries
+        sources_json = _store_sources(conn, sources)
+        # The question gets its own entry now, so it is no longer an alias of a merged one
+        conn.execute("DELETE FROM cache_aliases WHERE question_hash = ?", (question_hash(question),))
         conn.execute(
             """
             INSERT INTO query_cache 
-                (question, question_embedding, answer, sources)
+                (question, question_hash, question_embedding, answer, sources)
             VALUES 
-                (?, ?, ?, ?)
+                (?, ?, ?, ?, ?)
+            ON CONFLICT(question_hash) DO UPDATE SET
+                question = excluded.question,
+                question_embedding = excluded.question_embedding,
+                answer = excluded.answer,
+                sources = excluded.sources,
+                created_at = CURRENT_TIMESTAMP,
+                invalidated = 0
             """,
             (
                 question,
-                json.dumps(question_embedding),
+                question_hash(question),
+                _encode_embedding(question_embedding),
                 answer,
                 sources_json
             )
         )
+        entry_id = conn.execute(
+            "SELECT id FROM query_cache WHERE question_hash = ?", (question_hash(question),)
+        ).fetchone()[0]
+        _store_dependencies(conn, entry_id, sources)
         conn.commit()
     logger.info("💾 Response cached successfully")
 
+def invalidate_dependents(restaurants: List[Tuple[str, str]] = (), cities: List[str] = ()) -> int:
+    """
+    Invalidate entries built from the given restaurants or cities.
+    
+    Args:
+        restaurants: (city, restaurant) pairs whose reviews changed
+        cities: Cities whose set of restaurants changed
+        
+    Returns:
+        Number of entries invalidated
+    """
+    with _connect() as conn:
+        entry_ids = set()
+        for city, restaurant in restaurants:
+            entry_ids.update(row[0] for row in conn.execute(
+                "SELECT entry_id FROM cache_dependencies WHERE restaurant = ? AND city = ?",
+                (_dependency_key(restaurant), _dependency_key(city))
+            ))
+        for city in cities:
+            entry_ids.update(row[0] for row in conn.execute(
+                "SELECT entry_id FROM cache_dependencies WHERE city = ?", (_dependency_key(city),)
+            ))
+        if not entry_ids:
+            return 0
+        
+        ids = list(entry_ids)
+        placeholders = ",".join("?" * len(ids))
+        if INVALIDATION_MODE == "delete":
+            conn.execute(f"DELETE FROM query_cache WHERE id IN ({placeholders})", ids)
+            _prune_orphans(conn)
+        else:
+            # Served stale and refreshed in the background, like entries past the soft TTL
+            conn.execute(f"UPDATE query_cache SET invalidated = 1 WHERE id IN ({placeholders})", ids)
+        conn.commit()
+    logger.info(f"🎯 Invalidated {len(ids)} cache entries ({INVALIDATION_MODE})")
+    return len(ids)
+
+def sync_cache_with_reviews(restaurant_digests: dict) -> int:
+    """
+    Invalidate entries whose underlying reviews changed since the last sync.
+    
+    Args:
+        restaurant_digests: "city|restaurant" → digest of that restaurant's reviews,
+            as published by the vector index
+        
+    Returns:
+        Number of entries invalidated
+    """
+    with _connect() as conn:
+        row = conn.execute("SELECT value FROM cache_state WHERE key = 'restaurant_digests'").fetchone()
+    previous = json.loads(row[0]) if row else None
+    
+    invalidated = 0
+    if previous is None:
+        logger.info("🎯 No previous review digests, recording the current ones")
+    elif previous != restaurant_digests:
+        changed = {
+            key for key in previous.keys() | restaurant_digests.keys()
+            if previous.get(key) != restaurant_digests.get(key)
+        }
+        # A restaurant added to or removed from a city can change that city's answers
+        added_or_removed = changed - (previous.keys() & restaurant_digests.keys())
+        restaurants = [tuple(key.split("|", 1)) for key in changed]
+        cities = {key.split("|", 1)[0] for key in added_or_removed}
+        logger.info(f"🎯 Reviews changed for {len(changed)} restaurants ({len(cities)} cities gained or lost restaurants)")
+        invalidated = invalidate_dependents(restaurants, list(cities))
+    
+    with _connect() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO cache_state (key, value) VALUES ('restaurant_digests', ?)",
+            (json.dumps(restaurant_digests, sort_keys=True),)
+        )
+        conn.commit()
+    return invalidated
+
+@dataclass
+class CachedEmbedding:
+    entry_id: int
+    question: str
+    hit_count: int
+    embedding: np.ndarray
+    is_stale: bool  # Past the soft TTL or invalidated
+    review_ids: set  # Source review IDs
+    cities: set  # Cities the sources came from
+
+def load_cache_embeddings() -> List[CachedEmbedding]:
+    """
+    Load the question embedding, sources and cities of every unexpired entry,
+    for offline jobs such as compaction.
+    """
+    expiry, soft_expiry = _cache_expiries()
+    with _connect() as conn:
+        rows = conn.execute(
+            """
+            SELECT id, question, hit_count, question_embedding, created_at < ? OR invalidated, sources
+            FROM query_cache WHERE created_at > ?
+            """,
+            (soft_expiry, expiry)
+        ).fetchall()
+        cities = {}
+        for entry_id, city in conn.execute("SELECT entry_id, city FROM cache_dependencies WHERE city != ''"):
+            cities.setdefault(entry_id, set()).add(city)
+    return [
+        CachedEmbedding(
+            entry_id=entry_id,
+            question=question,
+            hit_count=hit_count or 0,
+            embedding=_decode_embedding(embedding),
+            is_stale=bool(is_stale),
+            review_ids=set(json.loads(sources_json)),
+            cities=cities.get(entry_id, set()),
+        )
+        for entry_id, question, hit_count, embedding, is_stale, sources_json in rows
+    ]
+
+def merge_cache_entries(canonical_id: int, merged_ids: List[int]) -> int:
+    """
+    Fold near-duplicate entries into a canonical one.
+    
+    The canonical entry keeps its answer and embedding and absorbs the merged
+    entries' hit counts; their questions (and any aliases they had) become
+    aliases of the canonical entry so exact repeats still hit.
+    
+    Returns:
+        Number of aliases pointing at the canonical entry after the merge
+    """
+    if not merged_ids:
+        return 0
+    
+    placeholders = ",".join("?" * len(merged_ids))
+    with _connect() as conn:
+        merged = conn.execute(
+            f"SELECT question, question_hash, hit_count FROM query_cache WHERE id IN ({placeholders})",
+            merged_ids
+        ).fetchall()
+        
+        conn.execute(
+            f"UPDATE cache_aliases SET entry_id = ? WHERE entry_id IN ({placeholders})",
+            [canonical_id, *merged_ids]
+        )
+        for question, q_hash, _ in merged:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_aliases (question_hash, question, entry_id) VALUES (?, ?, ?)",
+                (q_hash or question_hash(question), question, canonical_id)
+            )
+        conn.execute(
+            "UPDATE query_cache SET hit_count = hit_count + ? WHERE id = ?",
+            (sum(hit_count or 0 for _, _, hit_count in merged), canonical_id)
+        )
+        conn.execute(f"DELETE FROM query_cache WHERE id IN ({placeholders})", merged_ids)
+        _prune_orphans(conn)
+        conn.commit()
+        
+        return conn.execute(
+            "SELECT COUNT(*) FROM cache_aliases WHERE entry_id = ?", (canonical_id,)
+        ).fetchone()[0]
+
 def get_cached_entries() -> List[dict]:
     """
     Get all cached Q&As with metadata.
@@ -298,7 +815,7 @@ def get_cached_entries() -> List[dict]:
         - created_at: Timestamp
         - hit_count: Times accessed
     """
-    with sqlite3.connect(DB_PATH) as conn:
+    with _connect() as conn:
         cursor = conn.execute(
             """
             SELECT question, answer, created_at, hit_count 
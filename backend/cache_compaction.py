@@ -0,0 +1,160 @@
+"""
+Cache Compaction
+================
+
+Merges near-duplicate cache entries. `cache_response` stores every cacheable
+miss, so paraphrases pile up as separate entries answering the same thing
+(e.g. two misses cached before either could match the other), using capacity
+and lengthening every semantic scan.
+
+Compaction clusters the question embeddings of unexpired `query_cache` entries
+and folds each cluster into one canonical entry (a fresh one, most-hit first).
+The canonical entry keeps its answer and absorbs the cluster's hit counts; the
+merged questions are kept as aliases, so exact repeats of them still hit
+without an embedding. Because aliases are served at similarity 1.0, entries
+are only merged at or above the lookup threshold and when they share a source
+review or city, so "best pizza in Haifa" never absorbs "...in Tel Aviv".
+
+Usage:
+    # One-off compaction
+    python -m backend.cache_compaction --threshold 0.95
+
+    # Periodic compaction (started by the API when CACHE_COMPACTION_ENABLED=true)
+    from backend.cache_compaction import start_scheduled_compaction
+    start_scheduled_compaction()
+"""
+
+import argparse
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import List
+import numpy as np
+from backend.cache import CachedEmbedding, SIMILARITY_THRESHOLD, load_cache_embeddings, merge_cache_entries
+from logger_config import setup_logger
+
+# --- Configuration ---
+COMPACTION_THRESHOLD = max(float(os.getenv("CACHE_COMPACTION_THRESHOLD", SIMILARITY_THRESHOLD)), SIMILARITY_THRESHOLD)  # Min cosine similarity to merge
+COMPACTION_INTERVAL_HOURS = float(os.getenv("CACHE_COMPACTION_INTERVAL_HOURS", 6))  # Time between scheduled runs
+
+# --- Setup ---
+logger = setup_logger(name="cache_compaction", log_file="logs/cache_compaction.log")
+
+@dataclass
+class CompactionReport:
+    entries_before: int = 0
+    entries_after: int = 0
+    clusters_merged: int = 0
+    entries_merged: int = 0
+    threshold: float = COMPACTION_THRESHOLD
+    duration_s: float = 0.0
+
+    def print_report(self):
+        """Print a human-readable compaction report."""
+        print("\n🗜️ Cache Compaction Report")
+        print("=" * 40)
+        print(f"Similarity threshold: {self.threshold:.2f}")
+        print(f"Entries before: {self.entries_before}")
+        print(f"Entries after: {self.entries_after}")
+        print(f"Clusters merged: {self.clusters_merged}")
+        print(f"Entries merged into aliases: {self.entries_merged}")
+        print(f"Duration: {self.duration_s:.1f}s")
+
+def _shares_context(a: CachedEmbedding, b: CachedEmbedding) -> bool:
+    """Entries answering the same thing draw on the same reviews or at least the same city."""
+    return bool(a.review_ids & b.review_ids) or bool(a.cities & b.cities)
+
+def cluster_entries(entries: List[CachedEmbedding], threshold: float) -> List[List[int]]:
+    """
+    Greedy leader clustering. Fresh entries lead before stale or invalidated
+    ones, most-hit first; a leader takes every unassigned entry at least
+    `threshold` similar to it that shares a source review or city with it.
+
+    Returns:
+        Clusters as lists of indexes into `entries`, leader first
+    """
+    if not entries:
+        return []
+    embeddings = np.vstack([entry.embedding for entry in entries])
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    normalized = embeddings / np.where(norms == 0, 1, norms)
+    similarities = normalized @ normalized.T
+
+    assigned = np.zeros(len(entries), dtype=bool)
+    clusters = []
+    for leader in sorted(range(len(entries)), key=lambda i: (entries[i].is_stale, -entries[i].hit_count)):
+        if assigned[leader]:
+            continue
+        assigned[leader] = True
+        candidates = np.flatnonzero((similarities[leader] >= threshold) & ~assigned)
+        members = [int(i) for i in candidates if _shares_context(entries[leader], entries[i])]
+        assigned[members] = True
+        clusters.append([leader] + members)
+    return clusters
+
+def compact_cache(threshold: float = COMPACTION_THRESHOLD) -> CompactionReport:
+    """
+    Merge near-duplicate unexpired cache entries into canonical ones.
+
+    Args:
+        threshold: Minimum cosine similarity between a canonical entry and an entry
+            merged into it; never below the lookup threshold, since merged questions
+            become exact-match aliases
+
+    Returns:
+        CompactionReport summarizing the run
+    """
+    start_time = time.time()
+    if threshold < SIMILARITY_THRESHOLD:
+        logger.warning(f"⚠️ Compaction threshold {threshold} is below the lookup threshold, using {SIMILARITY_THRESHOLD}")
+        threshold = SIMILARITY_THRESHOLD
+    report = CompactionReport(threshold=threshold)
+
+    entries = load_cache_embeddings()
+    report.entries_before = len(entries)
+    for cluster in cluster_entries(entries, threshold):
+        if len(cluster) < 2:
+            continue
+        canonical = entries[cluster[0]]
+        merged_ids = [entries[i].entry_id for i in cluster[1:]]
+        merge_cache_entries(canonical.entry_id, merged_ids)
+        report.clusters_merged += 1
+        report.entries_merged += len(merged_ids)
+        logger.info(f"🗜️ Merged {len(merged_ids)} entries into '{canonical.question}'")
+
+    report.entries_after = report.entries_before - report.entries_merged
+    report.duration_s = time.time() - start_time
+    logger.info(
+        f"✅ Compaction done: {report.entries_before} → {report.entries_after} entries "
+        f"({report.clusters_merged} clusters) in {report.duration_s:.1f}s"
+    )
+    return report
+
+def _schedule_loop(stop_event: threading.Event):
+    """Run compact_cache every COMPACTION_INTERVAL_HOURS."""
+    while not stop_event.wait(COMPACTION_INTERVAL_HOURS * 3600):
+        try:
+            compact_cache()
+        except Exception as e:
+            logger.error(f"❌ Scheduled compaction failed: {e}")
+
+def start_scheduled_compaction() -> threading.Event:
+    """
+    Start periodic compaction in a daemon thread.
+
+    Returns:
+        Event that stops the scheduler when set
+    """
+    stop_event = threading.Event()
+    thread = threading.Thread(target=_schedule_loop, args=(stop_event,), name="cache-compaction", daemon=True)
+    thread.start()
+    logger.info(f"⏰ Scheduled cache compaction every {COMPACTION_INTERVAL_HOURS:g}h")
+    return stop_event
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge near-duplicate pizza cache entries")
+    parser.add_argument("--threshold", type=float, default=COMPACTION_THRESHOLD, help="Min cosine similarity to merge")
+    args = parser.parse_args()
+
+    compact_cache(threshold=args.threshold).print_report()
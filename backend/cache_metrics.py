@@ -18,6 +18,8 @@ class CacheMetrics:
     total_queries: int
     cache_hits: int
     cache_misses: int
+    stale_hits: int
+    exact_hits: int
     avg_similarity_score: float
     cache_size_bytes: int
     most_common_queries: List[tuple[str, int]]
@@ -28,9 +30,15 @@ class MetricsTracker:
         self.db_path = db_path
         self._setup_metrics_table()
 
+    def _connect(self) -> sqlite3.Connection:
+        """Open the metrics DB; synchronous=NORMAL avoids an fsync per recorded query under WAL."""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
     def _setup_metrics_table(self):
         """Create metrics tracking table if it doesn't exist."""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect() as conn:
             conn.execute("""
             CREATE TABLE IF NOT EXISTS cache_metrics (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -41,31 +49,68 @@ class MetricsTracker:
                 response_time_saved_ms FLOAT
             )
             """)
+
+            # Add stale_hit column if it doesn't exist
+            columns = [col[1] for col in conn.execute("PRAGMA table_info(cache_metrics)").fetchall()]
+            if 'stale_hit' not in columns:
+                conn.execute("ALTER TABLE cache_metrics ADD COLUMN stale_hit BOOLEAN DEFAULT 0")
+
+            # Add match_type column ("exact" / "semantic") if it doesn't exist
+            if 'match_type' not in columns:
+                conn.execute("ALTER TABLE cache_metrics ADD COLUMN match_type TEXT")
+
             conn.commit()
 
-    def record_query(self, query: str, cache_hit: bool, similarity: Optional[float] = None, time_saved_ms: Optional[float] = None):
-        """Record metrics for a single query."""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute(
+    def record_query(self, query: str, cache_hit: bool, similarity: Optional[float] = None, time_saved_ms: Optional[float] = None, stale: bool = False, match_type: Optional[str] = None, conn: Optional[sqlite3.Connection] = None):
+        """
+        Record metrics for a single query.
+
+        `stale` marks hits served past the soft TTL; `match_type` is "exact" or "semantic" for hits.
+        When `conn` is given the row joins the caller's transaction, which commits it.
+        """
+        row = (query, cache_hit, similarity, time_saved_ms, stale, match_type)
+        sql = """
+            INSERT INTO cache_metrics (query, cache_hit, similarity_score, response_time_saved_ms, stale_hit, match_type)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """
+        if conn is not None:
+            conn.execute(sql, row)
+            return
+        with self._connect() as own_conn:
+            own_conn.execute(sql, row)
+            own_conn.commit()
+
+    def get_frequent_queries(self, time_window_hours: int = 24, limit: int = 20) -> List[tuple[str, int]]:
+        """Get the most frequently asked queries in the time window, most frequent first."""
+        since = datetime.now() - timedelta(hours=time_window_hours)
+
+        with self._connect() as conn:
+            cursor = conn.execute(
                 """
-                INSERT INTO cache_metrics (query, cache_hit, similarity_score, response_time_saved_ms)
-                VALUES (?, ?, ?, ?)
+                SELECT query, COUNT(*) as count 
+                FROM cache_metrics 
+                WHERE timestamp > ?
+                GROUP BY query 
+                ORDER BY count DESC 
+                LIMIT ?
                 """,
-                (query, cache_hit, similarity, time_saved_ms)
+                (since, limit)
             )
-            conn.commit()
+            return cursor.fetchall()
 
     def get_metrics(self, time_window_hours: int = 24) -> CacheMetrics:
         """Get cache performance metrics for the specified time window."""
         since = datetime.now() - timedelta(hours=time_window_hours)
         
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect() as conn:
             # Get basic stats
             cursor = conn.execute(
                 """
                 SELECT 
                     COUNT(*) as total,
                     SUM(CASE WHEN cache_hit THEN 1 ELSE 0 END) as hits,
+                    SUM(CASE WHEN cache_hit AND stale_hit THEN 1 ELSE 0 END) as stale_hits,
+                    SUM(CASE WHEN cache_hit AND match_type = 'exact' THEN 1 ELSE 0 END) as exact_hits,
                     AVG(CASE WHEN cache_hit THEN similarity_score ELSE 0 END) as avg_sim,
                     AVG(CASE WHEN cache_hit THEN response_time_saved_ms ELSE 0 END) as avg_time
                 FROM cache_metrics 
@@ -76,33 +121,28 @@ class MetricsTracker:
             row = cursor.fetchone()
             total = row[0]
             hits = row[1] or 0
-            avg_sim = row[2] or 0.0
-            avg_time_saved = row[3] or 0.0
+            stale_hits = row[2] or 0
+            exact_hits = row[3] or 0
+            avg_sim = row[4] or 0.0
+            avg_time_saved = row[5] or 0.0
 
-            # Get most common queries
-            cursor = conn.execute(
-                """
-                SELECT query, COUNT(*) as count 
-                FROM cache_metrics 
-                WHERE timestamp > ?
-                GROUP BY query 
-                ORDER BY count DESC 
-                LIMIT 5
-                """,
-                (since,)
-            )
-            common_queries = cursor.fetchall()
-
-            # Calculate cache size
+            # Calculate cache size, including the shared source review table
             cursor = conn.execute(
                 "SELECT SUM(LENGTH(question_embedding) + LENGTH(answer) + LENGTH(sources)) FROM query_cache"
             )
             cache_size = cursor.fetchone()[0] or 0
+            cursor = conn.execute("SELECT SUM(LENGTH(content) + LENGTH(metadata)) FROM cache_reviews")
+            cache_size += cursor.fetchone()[0] or 0
+
+        # Get most common queries
+        common_queries = self.get_frequent_queries(time_window_hours, limit=5)
 
         return CacheMetrics(
             total_queries=total,
             cache_hits=hits,
             cache_misses=total - hits,
+            stale_hits=stale_hits,
+            exact_hits=exact_hits,
             avg_similarity_score=avg_sim,
             cache_size_bytes=cache_size,
             most_common_queries=common_queries,
@@ -120,6 +160,8 @@ class MetricsTracker:
         print(f"Time Window: Last {time_window_hours} hours")
         print(f"Total Queries: {metrics.total_queries}")
         print(f"Cache Hit Rate: {hit_rate:.1f}%")
+        print(f"Fresh / Stale Hits: {metrics.cache_hits - metrics.stale_hits} / {metrics.stale_hits}")
+        print(f"Exact / Semantic Hits: {metrics.exact_hits} / {metrics.cache_hits - metrics.exact_hits}")
         print(f"Average Similarity Score: {metrics.avg_similarity_score:.3f}")
         print(f"Average Time Saved: {metrics.avg_response_time_saved_ms:.0f}ms")
         print(f"Cache Size: {metrics.cache_size_bytes / 1024 / 1024:.1f}MB")
@@ -0,0 +1,201 @@
+"""
+Cache Warmer
+============
+
+Precomputes answers for the most frequently asked pizza questions so that the
+first users after a deploy, cache wipe or TTL expiry get cache hits instead of
+paying for two LLM calls.
+
+Candidates come from the `cache_metrics` query log. Questions that already have
+a fresh cache entry, or that would never be cached, are skipped; stale entries
+are regenerated in place and the rest are generated and cached directly,
+all with bounded concurrency.
+
+Usage:
+    # One-off warm-up (e.g. right after a deploy)
+    python -m backend.cache_warmer --top 20 --hours 24 --concurrency 2
+
+    # Scheduled off-peak warm-up (started by the API when CACHE_WARMUP_ENABLED=true)
+    from backend.cache_warmer import start_scheduled_warmup
+    start_scheduled_warmup()
+"""
+
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from datetime import datetime, date
+from typing import List, Optional
+from backend.cache import metrics, peek_cached_response, question_hash, should_cache_query
+from backend.core import generate_and_cache_answer, refresh_cache_entry
+from logger_config import setup_logger
+
+# --- Configuration ---
+WARM_TOP_N = int(os.getenv("CACHE_WARMUP_TOP_N", 20))  # Number of frequent queries to consider
+WARM_WINDOW_HOURS = int(os.getenv("CACHE_WARMUP_WINDOW_HOURS", 24))  # Look-back window for query frequency
+WARM_CONCURRENCY = int(os.getenv("CACHE_WARMUP_CONCURRENCY", 2))  # Questions answered in parallel
+OFF_PEAK_START_HOUR = int(os.getenv("CACHE_WARMUP_START_HOUR", 3))  # Scheduled runs start at this hour...
+OFF_PEAK_END_HOUR = int(os.getenv("CACHE_WARMUP_END_HOUR", 6))  # ...and never start at or after this hour
+SCHEDULE_CHECK_INTERVAL_S = 600  # How often the scheduler checks whether it is time to run
+
+# --- Setup ---
+logger = setup_logger(name="cache_warmer", log_file="logs/cache_warmer.log")
+
+@dataclass
+class WarmupReport:
+    candidates: int = 0
+    skipped_fresh: int = 0
+    skipped_uncacheable: int = 0
+    skipped_duplicate: int = 0  # Normalizes to, or matches the entry of, an earlier candidate
+    refresh_in_flight: int = 0  # Stale entry already being refreshed by a request
+    warmed: int = 0
+    refreshed_stale: int = 0
+    failed: int = 0
+    duration_s: float = 0.0
+    errors: List[str] = field(default_factory=list)
+
+    def print_report(self):
+        """Print a human-readable warm-up report."""
+        print("\n🔥 Cache Warm-up Report")
+        print("=" * 40)
+        print(f"Candidates: {self.candidates}")
+        print(f"Warmed: {self.warmed}")
+        print(f"Refreshed (stale): {self.refreshed_stale}")
+        print(f"Skipped (already fresh): {self.skipped_fresh}")
+        print(f"Skipped (not cacheable): {self.skipped_uncacheable}")
+        print(f"Skipped (duplicate): {self.skipped_duplicate}")
+        print(f"Skipped (refresh already in flight): {self.refresh_in_flight}")
+        print(f"Failed: {self.failed}")
+        print(f"Duration: {self.duration_s:.1f}s")
+
+        for error in self.errors:
+            print(f"- {error}")
+
+def _warm_question(question: str, entry_id: Optional[int] = None, cached_question: Optional[str] = None) -> bool:
+    """
+    Answer a single question, regenerating its stale entry in place if it has one.
+
+    Returns:
+        False if the stale entry was already being refreshed elsewhere
+    """
+    if entry_id is not None:
+        return refresh_cache_entry(entry_id, cached_question)
+    # Skips the cache lookup, so warm-up does not show up as misses in cache_metrics
+    generate_and_cache_answer(question)
+    return True
+
+def warm_cache(
+    top_n: int = WARM_TOP_N,
+    window_hours: int = WARM_WINDOW_HOURS,
+    concurrency: int = WARM_CONCURRENCY,
+) -> WarmupReport:
+    """
+    Precompute answers for the most frequent queries that are not already cached.
+
+    Args:
+        top_n: Number of most frequent queries to consider
+        window_hours: Look-back window used to rank query frequency
+        concurrency: Maximum number of questions answered in parallel
+
+    Returns:
+        WarmupReport summarizing the run
+    """
+    start_time = time.time()
+    report = WarmupReport()
+
+    frequent = metrics.get_frequent_queries(window_hours, limit=top_n)
+    report.candidates = len(frequent)
+    logger.info(f"🔥 Warming cache from {len(frequent)} frequent queries (last {window_hours}h)")
+
+    to_warm = []
+    seen = set()  # Question hashes and entry IDs already scheduled
+    for question, count in frequent:
+        if not should_cache_query(question):
+            report.skipped_uncacheable += 1
+            continue
+
+        cached = peek_cached_response(question)
+        if cached is not None and not cached.is_stale:
+            report.skipped_fresh += 1
+            continue
+
+        # "best pizza in TLV" and "Best pizza in TLV?" would otherwise be generated twice
+        key = question_hash(question) if cached is None else cached.entry_id
+        if key in seen:
+            report.skipped_duplicate += 1
+            continue
+        seen.add(key)
+
+        if cached is None:
+            to_warm.append((question, None, None))
+        else:
+            to_warm.append((question, cached.entry_id, cached.question))
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = {executor.submit(_warm_question, *item): item for item in to_warm}
+        for future in as_completed(futures):
+            question, entry_id, _ = futures[future]
+            try:
+                if not future.result():
+                    report.refresh_in_flight += 1
+                elif entry_id is not None:
+                    report.refreshed_stale += 1
+                else:
+                    report.warmed += 1
+            except Exception as e:
+                report.failed += 1
+                report.errors.append(f"'{question}': {e}")
+                logger.warning(f"⚠️ Failed to warm '{question}': {e}")
+
+    report.duration_s = time.time() - start_time
+    logger.info(
+        f"✅ Warm-up done: {report.warmed} warmed, {report.refreshed_stale} refreshed, {report.skipped_fresh} fresh, "
+        f"{report.skipped_uncacheable} uncacheable, {report.skipped_duplicate} duplicate, "
+        f"{report.refresh_in_flight} already refreshing, {report.failed} failed in {report.duration_s:.1f}s"
+    )
+    return report
+
+def is_off_peak(now: Optional[datetime] = None) -> bool:
+    """Check whether the current local hour falls in the off-peak warm-up window."""
+    hour = (now or datetime.now()).hour
+    if OFF_PEAK_START_HOUR <= OFF_PEAK_END_HOUR:
+        return OFF_PEAK_START_HOUR <= hour < OFF_PEAK_END_HOUR
+    # Window wraps around midnight (e.g. 23 -> 4)
+    return hour >= OFF_PEAK_START_HOUR or hour < OFF_PEAK_END_HOUR
+
+def _schedule_loop(stop_event: threading.Event):
+    """Run warm_cache at most once per day, inside the off-peak window."""
+    last_run: Optional[date] = None
+    while not stop_event.is_set():
+        today = date.today()
+        if is_off_peak() and last_run != today:
+            try:
+                warm_cache()
+            except Exception as e:
+                logger.error(f"❌ Scheduled warm-up failed: {e}")
+            last_run = today
+        stop_event.wait(SCHEDULE_CHECK_INTERVAL_S)
+
+def start_scheduled_warmup() -> threading.Event:
+    """
+    Start the off-peak warm-up scheduler in a daemon thread.
+
+    Returns:
+        Event that stops the scheduler when set
+    """
+    stop_event = threading.Event()
+    thread = threading.Thread(target=_schedule_loop, args=(stop_event,), name="cache-warmer", daemon=True)
+    thread.start()
+    logger.info(f"⏰ Scheduled cache warm-up between {OFF_PEAK_START_HOUR}:00 and {OFF_PEAK_END_HOUR}:00")
+    return stop_event
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute answers for frequent pizza questions")
+    parser.add_argument("--top", type=int, default=WARM_TOP_N, help="Number of frequent queries to consider")
+    parser.add_argument("--hours", type=int, default=WARM_WINDOW_HOURS, help="Look-back window in hours")
+    parser.add_argument("--concurrency", type=int, default=WARM_CONCURRENCY, help="Parallel questions")
+    args = parser.parse_args()
+
+    warm_cache(top_n=args.top, window_hours=args.hours, concurrency=args.concurrency).print_report()
@@ -4,10 +4,16 @@
 from langchain_ollama.llms import OllamaLLM
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI
-from backend.vector import get_retriever
-from backend.cache import get_cached_response, cache_response
+from backend.vector import get_retriever, get_restaurant_digests
+from backend.admission import admit, backend_name
+from backend.llm_router import HedgedLLM
+from backend.cache import lookup_cached_response, cache_response, update_cached_response, sync_cache_with_reviews
 from logger_config import setup_logger
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Iterator
 from dotenv import load_dotenv
+import threading
 import os
 
 
@@ -18,6 +24,23 @@ print(os.getenv("FIREWORKS_API_KEY"))
 # --- Setup logger ---
 logger = setup_logger(name="core", log_file="logs/core.log")
 
+# --- LLM routing ---
+# "auto" hedges each LLM call across local and cloud backends; anything else uses
+# only the backend chosen by the use_cloud_llm toggle.
+LLM_MODE = os.getenv("LLM_MODE", "local").lower()
+
+# --- Stale-while-revalidate refreshes ---
+REFRESH_WORKERS = 2  # Background threads regenerating stale cache entries
+_refresh_executor = ThreadPoolExecutor(max_workers=REFRESH_WORKERS, thread_name_prefix="cache-refresh")
+_refresh_lock = threading.Lock()
+_refreshes_in_flight: set[int] = set()
+
+# --- Invalidate cached answers whose reviews changed since the last index build ---
+try:
+    sync_cache_with_reviews(get_restaurant_digests())
+except Exception as e:
+    logger.error(f"❌ Failed to sync cache with review index: {e}")
+
 # --- toggle LLM Loader ---
 def load_llm(use_cloud_llm: bool = False):
     """Load either a local Ollama model or Together AI cloud model based on toggle."""
@@ -32,6 +55,13 @@ def load_llm(use_cloud_llm: bool = False):
         logger.info("🧠 Using Local Ollama LLM")
         return OllamaLLM(model="llama3.2")
 
+def load_hedged_llm(use_cloud_llm: bool = False) -> HedgedLLM:
+    """Load a router that hedges between both backends, preferring the toggled one."""
+    return HedgedLLM(
+        {"local": load_llm(False), "cloud": load_llm(True)},
+        primary=backend_name(use_cloud_llm)
+    )
+
 # --- Prompt Templates ---
 # Template that instructs the LLM to extract and normalize city names and rewrite vague questions.
 rewrite_template = ChatPromptTemplate.from_template("""
@@ -128,33 +158,168 @@ def format_reviews(docs: list) -> str:
         for i, doc in enumerate(docs)
     ])
 
-def get_pizza_answer(question: str, use_cloud_llm: bool = False) -> tuple[str, list]:
-    logger.info("-------------- 🚀 Handling new pizza question --------------")
+def _stream_generated_answer(question: str, use_cloud_llm: bool = False) -> Iterator[tuple[str, object]]:
+    """
+    Run the full rewrite → retrieve → answer pipeline, bypassing the cache.
 
-    # Try cache first
-    cached_result = get_cached_response(question)
-    if cached_result:
-        logger.info("🎯 Using cached response")
-        return cached_result
+    Yields ("sources", docs) once retrieval is done, then ("token", text) chunks
+    as the LLM generates the answer.
 
-    llm = load_llm(use_cloud_llm)
+    Raises:
+        OverloadedError: If the LLM backend's admission queue is full or its deadline passes
+    """
+    if LLM_MODE == "auto":
+        # The router admits each call on whichever backend serves it
+        llm = load_hedged_llm(use_cloud_llm)
+        admission = nullcontext()
+    else:
+        llm = load_llm(use_cloud_llm)
+        # Hold one LLM slot for both stages so an admitted request is never rejected halfway
+        admission = admit(backend_name(use_cloud_llm))
 
     # build chains  
     rewrite_chain = rewrite_template | llm
     answer_chain = answer_template | llm
 
-    city, rewritten_query = rewrite_and_extract_city(question, rewrite_chain)
+    with admission:
+        city, rewritten_query = rewrite_and_extract_city(question, rewrite_chain)
+
+        retriever = get_retriever(city or None)
+        docs = retriever.invoke(rewritten_query)
+        yield "sources", docs
+
+        reviews = format_reviews(docs)
+        logger.info("🧠 Calling LLM to generate answer")
+        # In auto mode the hedged router does not stream and yields the whole answer as one chunk
+        for chunk in answer_chain.stream({"reviews": reviews, "question": question}):
+            yield "token", chunk.content if hasattr(chunk, "content") else str(chunk)
+
+
+def _generate_answer(question: str, use_cloud_llm: bool = False) -> tuple[str, list]:
+    """Run the full pipeline, bypassing the cache, and return the complete answer."""
+    docs, tokens = [], []
+    for kind, value in _stream_generated_answer(question, use_cloud_llm):
+        if kind == "sources":
+            docs = value
+        else:
+            tokens.append(value)
+    return "".join(tokens), docs
+
+
+def _claim_refresh(entry_id: int) -> bool:
+    """Mark a cache entry as being refreshed; False if a refresh is already in flight."""
+    with _refresh_lock:
+        if entry_id in _refreshes_in_flight:
+            return False
+        _refreshes_in_flight.add(entry_id)
+        return True
+
+
+def _run_refresh(entry_id: int, question: str, use_cloud_llm: bool):
+    """Regenerate a claimed cache entry and release the claim when done."""
+    try:
+        answer_text, docs = _generate_answer(question, use_cloud_llm)
+        update_cached_response(entry_id, answer_text, docs)
+    finally:
+        with _refresh_lock:
+            _refreshes_in_flight.discard(entry_id)
+
+
+def _run_background_refresh(entry_id: int, question: str, use_cloud_llm: bool):
+    """Executor entry point: refresh failures are logged, and the stale entry keeps serving."""
+    try:
+        _run_refresh(entry_id, question, use_cloud_llm)
+    except Exception as e:
+        logger.error(f"❌ Background refresh of cache entry {entry_id} failed: {e}")
+
+
+def refresh_cache_entry(entry_id: int, question: str, use_cloud_llm: bool = False) -> bool:
+    """
+    Regenerate a cache entry synchronously.
+
+    Returns:
+        False if another refresh of the same entry is already in flight
+    """
+    if not _claim_refresh(entry_id):
+        return False
+    _run_refresh(entry_id, question, use_cloud_llm)
+    return True
+
+
+def generate_and_cache_answer(question: str, use_cloud_llm: bool = False) -> tuple[str, list]:
+    """
+    Answer a question through the full pipeline and cache it, without a cache lookup.
+
+    Used by offline jobs such as warm-up, so they do not record cache misses
+    in the query metrics.
+    """
+    answer_text, docs = _generate_answer(question, use_cloud_llm)
+    cache_response(question, answer_text, docs)
+    return answer_text, docs
+
+
+def schedule_cache_refresh(entry_id: int, question: str, use_cloud_llm: bool = False) -> bool:
+    """
+    Regenerate a stale cache entry in the background.
+
+    Only one refresh per entry is in flight at a time; duplicate requests are dropped.
 
-    retriever = get_retriever(city or None)
-    docs = retriever.invoke(rewritten_query)
+    Returns:
+        True if a new refresh was scheduled
+    """
+    if not _claim_refresh(entry_id):
+        logger.info(f"⏳ Refresh already in flight for cache entry {entry_id}")
+        return False
+    logger.info(f"♻️ Scheduling background refresh for cache entry {entry_id}")
+    _refresh_executor.submit(_run_background_refresh, entry_id, question, use_cloud_llm)
+    return True
 
-    reviews = format_reviews(docs)
-    logger.info("🧠 Calling LLM to generate answer")
-    answer = answer_chain.invoke({"reviews": reviews, "question": question})
-    answer_text = answer.content if hasattr(answer, "content") else str(answer)
+
+def get_pizza_answer(question: str, use_cloud_llm: bool = False) -> tuple[str, list]:
+    logger.info("-------------- 🚀 Handling new pizza question --------------")
+
+    # Try cache first; stale entries are served now and regenerated in the background
+    cached = lookup_cached_response(question)
+    if cached:
+        if cached.is_stale:
+            schedule_cache_refresh(cached.entry_id, cached.question, use_cloud_llm)
+        logger.info("🎯 Using cached response")
+        return cached.answer, cached.sources
+
+    answer_text, docs = _generate_answer(question, use_cloud_llm)
 
     # Cache the response
     cache_response(question, answer_text, docs)
 
     logger.info("✅ Answer ready")
-    return answer_text, docs
\ No newline at end of file
+    return answer_text, docs
+
+
+def stream_pizza_answer(question: str, use_cloud_llm: bool = False) -> Iterator[tuple[str, object]]:
+    """
+    Streaming variant of get_pizza_answer.
+
+    Yields ("sources", docs) first, then ("token", text) chunks. Cache hits
+    arrive as a single chunk; misses are cached once the answer is complete.
+    """
+    logger.info("-------------- 🚀 Handling new pizza question (streaming) --------------")
+
+    cached = lookup_cached_response(question)
+    if cached:
+        if cached.is_stale:
+            schedule_cache_refresh(cached.entry_id, cached.question, use_cloud_llm)
+        logger.info("🎯 Using cached response")
+        yield "sources", cached.sources
+        yield "token", cached.answer
+        return
+
+    docs, tokens = [], []
+    for kind, value in _stream_generated_answer(question, use_cloud_llm):
+        if kind == "sources":
+            docs = value
+        else:
+            tokens.append(value)
+        yield kind, value
+
+    cache_response(question, "".join(tokens), docs)
+    logger.info("✅ Answer streamed")
@@ -0,0 +1,160 @@
+"""
+Embedding Micro-Batcher
+=======================
+
+Collects concurrent `embed_query` calls for a few milliseconds (or until a batch
+is full), runs them through the model as one batched forward pass, and hands
+each caller its own vector. Under concurrency this replaces many batch-of-one
+passes with a few larger ones, which is far cheaper per text on CPU.
+
+The cache and the vector store share one model and one batcher per model name,
+so their embedding calls batch together.
+
+Usage:
+    from backend.embedding_batcher import get_shared_embeddings
+
+    embeddings = get_shared_embeddings("BAAI/bge-small-en-v1.5")
+    vector = embeddings.embed_query("best pizza in tel aviv")
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, asdict
+from typing import Dict, List
+from langchain_core.embeddings import Embeddings
+from langchain_huggingface import HuggingFaceEmbeddings
+from logger_config import setup_logger
+
+# --- Configuration ---
+MAX_BATCH_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", 32))  # Texts per forward pass
+MAX_WAIT_MS = float(os.getenv("EMBED_BATCH_MAX_WAIT_MS", 5))  # How long the first request waits for company
+RESULT_TIMEOUT_S = float(os.getenv("EMBED_RESULT_TIMEOUT_S", 30))  # Callers give up rather than hang on a stuck worker
+
+# --- Setup ---
+logger = setup_logger(name="embedding_batcher", log_file="logs/embedding_batcher.log")
+
+@dataclass
+class EmbeddingBatchStats:
+    model: str
+    max_batch_size: int
+    max_wait_ms: float
+    batches: int
+    texts: int
+    avg_batch_size: float
+    largest_batch: int
+    avg_queue_wait_ms: float
+    avg_forward_ms: float
+
+class MicroBatchingEmbeddings(Embeddings):
+    """Embeddings wrapper that batches concurrent embed_query calls into one forward pass."""
+
+    def __init__(self, base: Embeddings, name: str, max_batch_size: int = MAX_BATCH_SIZE, max_wait_ms: float = MAX_WAIT_MS):
+        self.base = base
+        self.name = name
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_ms / 1000
+
+        self._queue: "queue.Queue[tuple[str, Future, float]]" = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._texts = 0
+        self._largest_batch = 0
+        self._total_queue_wait_s = 0.0
+        self._total_forward_s = 0.0
+
+        self._worker = threading.Thread(target=self._run, name=f"embedding-batcher-{name}", daemon=True)
+        self._worker.start()
+
+    def embed_query(self, text: str) -> List[float]:
+        future: Future = Future()
+        self._queue.put((text, future, time.monotonic()))
+        return future.result(timeout=RESULT_TIMEOUT_S)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        # Document embedding (index builds) is already batched by the caller
+        return self.base.embed_documents(texts)
+
+    def _collect_batch(self) -> list:
+        """Block for the first request, then gather more until the batch is full or the wait expires."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_s
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            error: Exception = RuntimeError("Embedding batch returned no vector for this text")
+            try:
+                self._embed_batch(batch)
+            except Exception as e:
+                # Never let the single worker die: every later embed_query would wait on it
+                logger.error(f"❌ Embedding batch of {len(batch)} failed: {e}")
+                error = e
+            finally:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(error)
+
+    def _embed_batch(self, batch: list):
+        """Run one forward pass for the batch and hand each caller its vector."""
+        texts = [text for text, _, _ in batch]
+        start = time.monotonic()
+        # Queries go through embed_documents to batch them; bge-small uses the
+        # same encoding for queries and documents, so the vectors are identical.
+        vectors = self.base.embed_documents(texts)
+        forward_s = time.monotonic() - start
+        if len(vectors) != len(batch):
+            raise ValueError(f"Expected {len(batch)} vectors, got {len(vectors)}")
+
+        for (_, future, _), vector in zip(batch, vectors):
+            future.set_result(vector)
+
+        with self._stats_lock:
+            self._batches += 1
+            self._texts += len(batch)
+            self._largest_batch = max(self._largest_batch, len(batch))
+            self._total_queue_wait_s += sum(start - enqueued for _, _, enqueued in batch)
+            self._total_forward_s += forward_s
+
+    def stats(self) -> EmbeddingBatchStats:
+        with self._stats_lock:
+            return EmbeddingBatchStats(
+                model=self.name,
+                max_batch_size=self.max_batch_size,
+                max_wait_ms=self.max_wait_s * 1000,
+                batches=self._batches,
+                texts=self._texts,
+                avg_batch_size=(self._texts / self._batches) if self._batches else 0.0,
+                largest_batch=self._largest_batch,
+                avg_queue_wait_ms=(self._total_queue_wait_s / self._texts * 1000) if self._texts else 0.0,
+                avg_forward_ms=(self._total_forward_s / self._batches * 1000) if self._batches else 0.0,
+            )
+
+# --- Shared instances, one model and batcher per model name ---
+_shared: Dict[str, MicroBatchingEmbeddings] = {}
+_shared_lock = threading.Lock()
+
+def get_shared_embeddings(model_name: str) -> MicroBatchingEmbeddings:
+    """Load a HuggingFace embedding model once and wrap it in a shared micro-batcher."""
+    with _shared_lock:
+        if model_name not in _shared:
+            logger.info(f"🧮 Loading embedding model {model_name} (batch ≤{MAX_BATCH_SIZE}, wait ≤{MAX_WAIT_MS}ms)")
+            _shared[model_name] = MicroBatchingEmbeddings(HuggingFaceEmbeddings(model_name=model_name), model_name)
+        return _shared[model_name]
+
+def get_embedding_stats() -> List[dict]:
+    """Batch size and wait time stats for every shared embedding model."""
+    with _shared_lock:
+        batchers = list(_shared.values())
+    return [asdict(batcher.stats()) for batcher in batchers]
@@ -0,0 +1,242 @@
+"""
+Hedged LLM Routing
+==================
+
+Routes an LLM call to a primary backend and, if it has not answered within a
+latency budget, sends a hedge request to the secondary backend. Whichever
+answer arrives first wins. Calls run as asyncio tasks through each backend's
+`ainvoke`, so the loser is cancelled mid-request: its HTTP stream is closed and
+its admission slot released as soon as the race is decided.
+
+- The budget adapts to the primary's observed p95 latency
+- A backend error fails over to the other backend immediately
+- A backend with a high recent error rate is demoted to secondary
+- Each backend call goes through admission control (see backend/admission.py)
+
+Any LangChain Runnable can be a backend, so local stubs work for testing:
+
+    from langchain_core.runnables import RunnableLambda
+    router = HedgedLLM(
+        {"local": RunnableLambda(slow_fn), "cloud": RunnableLambda(fast_fn)},
+        primary="local",
+        use_admission=False,
+    )
+    router.invoke("prompt")
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, List, Optional
+import numpy as np
+from langchain_core.runnables import Runnable, RunnableConfig
+from backend.admission import admit_async, OverloadedError
+from logger_config import setup_logger
+
+# --- Configuration ---
+HEDGE_BUDGET_S = float(os.getenv("LLM_HEDGE_BUDGET_S", 4.0))  # Budget used until enough latency samples exist
+HEDGE_MIN_BUDGET_S = float(os.getenv("LLM_HEDGE_MIN_BUDGET_S", 1.0))
+HEDGE_MAX_BUDGET_S = float(os.getenv("LLM_HEDGE_MAX_BUDGET_S", 10.0))
+HEDGE_PERCENTILE = 95  # Hedge once the primary is slower than this percentile of its history
+LATENCY_WINDOW = 200  # Recent calls kept per backend for percentiles and error rates
+MIN_SAMPLES = 20  # Samples needed before the adaptive budget and demotion kick in
+DEMOTE_ERROR_RATE = 0.5  # Primary is demoted when its recent error rate exceeds this
+
+# --- Setup ---
+logger = setup_logger(name="llm_router", log_file="logs/llm_router.log")
+# Synchronous invoke() calls run their race on this shared loop
+_loop = asyncio.new_event_loop()
+threading.Thread(target=_loop.run_forever, name="llm-hedge-loop", daemon=True).start()
+
+@dataclass
+class BackendRoutingStats:
+    backend: str
+    calls: int
+    errors: int
+    error_rate: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    hedges_sent: int
+    hedge_wins: int  # Answers served by this backend as the secondary (hedge or failover)
+
+class BackendStats:
+    """Rolling latency and error history for one backend."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)  # Successful call durations in seconds
+        self._outcomes = deque(maxlen=LATENCY_WINDOW)  # True for success, False for error
+        self.calls = 0
+        self.errors = 0
+        self.hedges_sent = 0
+        self.hedge_wins = 0
+
+    def record(self, latency_s: float, ok: bool):
+        with self._lock:
+            self.calls += 1
+            self._outcomes.append(ok)
+            if ok:
+                self._latencies.append(latency_s)
+            else:
+                self.errors += 1
+
+    def record_hedge_sent(self):
+        with self._lock:
+            self.hedges_sent += 1
+
+    def record_hedge_win(self):
+        with self._lock:
+            self.hedge_wins += 1
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Latency percentile in seconds, or None without enough samples."""
+        with self._lock:
+            if len(self._latencies) < MIN_SAMPLES:
+                return None
+            return float(np.percentile(list(self._latencies), p))
+
+    def error_rate(self) -> float:
+        with self._lock:
+            if len(self._outcomes) < MIN_SAMPLES:
+                return 0.0
+            return 1 - sum(self._outcomes) / len(self._outcomes)
+
+    def snapshot(self) -> BackendRoutingStats:
+        with self._lock:
+            latencies = list(self._latencies)
+            outcomes = list(self._outcomes)
+            calls, errors = self.calls, self.errors
+            hedges_sent, hedge_wins = self.hedges_sent, self.hedge_wins
+
+        def pct(p):
+            return float(np.percentile(latencies, p) * 1000) if latencies else 0.0
+
+        return BackendRoutingStats(
+            backend=self.name,
+            calls=calls,
+            errors=errors,
+            error_rate=(1 - sum(outcomes) / len(outcomes)) if outcomes else 0.0,
+            p50_ms=pct(50),
+            p95_ms=pct(95),
+            p99_ms=pct(99),
+            hedges_sent=hedges_sent,
+            hedge_wins=hedge_wins,
+        )
+
+# --- Shared per-backend history, so per-request routers learn from all traffic ---
+_stats: Dict[str, BackendStats] = {}
+_stats_lock = threading.Lock()
+
+def get_backend_stats(name: str) -> BackendStats:
+    with _stats_lock:
+        if name not in _stats:
+            _stats[name] = BackendStats(name)
+        return _stats[name]
+
+def get_routing_stats() -> List[dict]:
+    """Latency percentiles, error rates and hedge counts for every backend seen so far."""
+    with _stats_lock:
+        stats = list(_stats.values())
+    return [asdict(s.snapshot()) for s in stats]
+
+class HedgedLLM(Runnable):
+    """Runnable that hedges each call across two LLM backends."""
+
+    def __init__(self, backends: Dict[str, Runnable], primary: str, use_admission: bool = True):
+        if len(backends) != 2 or primary not in backends:
+            raise ValueError("HedgedLLM needs exactly two backends, one of them the primary")
+        self.backends = backends
+        self.primary = primary
+        self.use_admission = use_admission
+
+    def _ordered_backends(self) -> tuple[str, str]:
+        """Primary first, unless its recent error rate says the other backend is healthier."""
+        primary = self.primary
+        secondary = next(name for name in self.backends if name != primary)
+        primary_errors = get_backend_stats(primary).error_rate()
+        if primary_errors > DEMOTE_ERROR_RATE and get_backend_stats(secondary).error_rate() < primary_errors:
+            logger.warning(f"⚠️ Demoting {primary} LLM (error rate {primary_errors:.0%}), routing to {secondary} first")
+            return secondary, primary
+        return primary, secondary
+
+    def hedge_budget_s(self, backend: str) -> float:
+        """How long to wait for a backend before hedging, from its latency history."""
+        observed = get_backend_stats(backend).percentile(HEDGE_PERCENTILE)
+        if observed is None:
+            return HEDGE_BUDGET_S
+        return min(max(observed, HEDGE_MIN_BUDGET_S), HEDGE_MAX_BUDGET_S)
+
+    async def _call(self, name: str, input: Any, config: Optional[RunnableConfig]):
+        """Invoke one backend under its admission control, recording latency and errors."""
+        stats = get_backend_stats(name)
+        async with admit_async(name) if self.use_admission else nullcontext():
+            start = time.monotonic()
+            try:
+                result = await self.backends[name].ainvoke(input, config)
+            except Exception:
+                # Cancellation is not an Exception, so a cancelled loser is not counted as an error
+                stats.record(time.monotonic() - start, ok=False)
+                raise
+            stats.record(time.monotonic() - start, ok=True)
+            return result
+
+    async def _race(self, input: Any, config: Optional[RunnableConfig]) -> Any:
+        primary, secondary = self._ordered_backends()
+        tasks = {asyncio.create_task(self._call(primary, input, config)): primary}
+        hedged = False
+
+        budget = self.hedge_budget_s(primary)
+        done, _ = await asyncio.wait(tasks, timeout=budget)
+        if not done:
+            logger.info(f"🏁 {primary} LLM exceeded {budget:.1f}s budget, hedging to {secondary}")
+            get_backend_stats(secondary).record_hedge_sent()
+            tasks[asyncio.create_task(self._call(secondary, input, config))] = secondary
+            hedged = True
+
+        errors = []
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name = tasks[task]
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        errors.append(e)
+                        logger.warning(f"⚠️ {name} LLM failed: {e}")
+                        if not hedged:
+                            logger.info(f"🔀 Failing over to {secondary} LLM")
+                            failover = asyncio.create_task(self._call(secondary, input, config))
+                            tasks[failover] = secondary
+                            pending.add(failover)
+                            hedged = True
+                        continue
+
+                    if name == secondary:
+                        get_backend_stats(secondary).record_hedge_win()
+                    logger.info(f"✅ Answer from {name} LLM")
+                    return result
+        finally:
+            # First answer wins; cancel the loser and wait until it has released its slot
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        # Both backends failed; surface overload over other errors so the API can return 429
+        overloaded = [e for e in errors if isinstance(e, OverloadedError)]
+        if len(overloaded) == len(errors):
+            raise overloaded[-1]
+        raise next(e for e in reversed(errors) if not isinstance(e, OverloadedError))
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        return asyncio.run_coroutine_threadsafe(self._race(input, config), _loop).result()
+
+    async def ainvoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        return await self._race(input, config)
@@ -0,0 +1,302 @@
+"""
+On-Demand Request Profiling
+===========================
+
+Lets an admin switch on sampling profiling for the next N `/ask-pizza` or
+`/ask-pizza/stream` requests, optionally only for requests carrying a given
+header, without redeploying.
+
+While a profiled request runs, a sampler thread records the Python stack of the
+request thread and of the shared worker threads (embedding batcher, hedged LLM
+calls, admission waits) every few milliseconds. Workers parked waiting for work
+are skipped, so they do not drown the request's own samples. Optionally a tracemalloc snapshot captures where
+memory was allocated. Each request produces a JSON report (top functions,
+allocations) and a collapsed-stack file that flamegraph.pl or speedscope can
+render, stored under `profiles/`.
+
+When profiling is not armed, `should_profile` is a single attribute check.
+
+Usage:
+    from backend.profiling import arm, should_profile, profile_request
+
+    arm(requests=5, allocations=True)
+    if should_profile(headers):
+        with profile_request("ask-pizza"):
+            ...
+
+    # Streamed responses: profiles every step until the iterator is exhausted or closed
+    events = profile_stream("ask-pizza-stream", events)
+"""
+
+import json
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, List, Mapping, Optional
+from logger_config import setup_logger
+
+# --- Configuration ---
+PROFILES_DIR = Path("profiles")
+SAMPLE_INTERVAL_S = 0.005  # 5ms between stack samples
+PROFILED_THREAD_PREFIXES = ("embedding-batcher", "llm-hedge", "admission-wait")  # Shared workers sampled alongside the request
+# A worker whose stack ends in one of these waits is idle, not serving a request
+IDLE_WAIT_MODULES = ("threading.py", "queue.py", "selectors.py")
+IDLE_WAIT_POINTS = {
+    ("_collect_batch", "embedding_batcher.py"),  # Batcher waiting for queued texts
+    ("_worker", "thread.py"),  # Thread pool worker waiting for a task
+    ("_run_once", "base_events.py"),  # Event loop waiting for I/O or timers
+}
+TOP_FUNCTIONS = 30
+TOP_ALLOCATIONS = 25
+MAX_REPORTS = 50  # Oldest reports are deleted beyond this
+REPORT_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+
+# --- Setup ---
+logger = setup_logger(name="profiling", log_file="logs/profiling.log")
+
+@dataclass
+class ProfilingStatus:
+    enabled: bool
+    remaining_requests: int
+    header_name: Optional[str]
+    header_value: Optional[str]
+    allocations: bool
+
+class _ProfilerState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.enabled = False  # Read without the lock on the hot path
+        self.remaining = 0
+        self.header_name: Optional[str] = None
+        self.header_value: Optional[str] = None
+        self.allocations = False
+        self.tracemalloc_users = 0
+
+_state = _ProfilerState()
+
+def arm(requests: int = 1, header_name: Optional[str] = None, header_value: Optional[str] = None, allocations: bool = False) -> ProfilingStatus:
+    """
+    Profile the next `requests` requests, or only those whose `header_name`
+    header equals `header_value` when a header is given.
+    """
+    with _state.lock:
+        _state.remaining = max(0, requests)
+        _state.header_name = header_name.lower() if header_name else None
+        _state.header_value = header_value
+        _state.allocations = allocations
+        _state.enabled = _state.remaining > 0
+    logger.info(f"🔬 Profiling armed for {requests} requests (header: {header_name or 'any'}, allocations: {allocations})")
+    return get_status()
+
+def disarm() -> ProfilingStatus:
+    with _state.lock:
+        _state.enabled = False
+        _state.remaining = 0
+    logger.info("🔬 Profiling disarmed")
+    return get_status()
+
+def get_status() -> ProfilingStatus:
+    with _state.lock:
+        return ProfilingStatus(
+            enabled=_state.enabled,
+            remaining_requests=_state.remaining,
+            header_name=_state.header_name,
+            header_value=_state.header_value,
+            allocations=_state.allocations,
+        )
+
+def should_profile(headers: Mapping[str, str]) -> bool:
+    """Decide whether this request is profiled, consuming one of the armed slots if so."""
+    if not _state.enabled:
+        return False
+    with _state.lock:
+        if _state.remaining <= 0:
+            return False
+        if _state.header_name:
+            value = headers.get(_state.header_name)
+            if value is None or (_state.header_value is not None and value != _state.header_value):
+                return False
+        _state.remaining -= 1
+        _state.enabled = _state.remaining > 0
+        return True
+
+class _StackSampler(threading.Thread):
+    """Periodically records the stacks of the request thread and shared worker threads."""
+
+    def __init__(self, request_thread_id: Optional[int]):
+        super().__init__(name="profiler-sampler", daemon=True)
+        self.request_thread_id = request_thread_id  # None while no request code is running
+        self.stop_event = threading.Event()
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.idle_samples = 0
+
+    def _thread_names(self, request_thread_id: Optional[int]) -> dict:
+        names = {}
+        for thread in threading.enumerate():
+            if thread.ident == request_thread_id:
+                names[thread.ident] = "request"
+            elif thread.name.startswith(PROFILED_THREAD_PREFIXES):
+                names[thread.ident] = thread.name
+        return names
+
+    def run(self):
+        while not self.stop_event.wait(SAMPLE_INTERVAL_S):
+            request_thread_id = self.request_thread_id
+            names = self._thread_names(request_thread_id)
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id not in names:
+                    continue
+                if thread_id != request_thread_id and _is_idle(frame):
+                    self.idle_samples += 1
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.stacks[";".join([names[thread_id]] + stack[::-1])] += 1
+            self.samples += 1
+
+def _is_idle(frame) -> bool:
+    """True if a worker's innermost frames are a wait for new work."""
+    while frame is not None and Path(frame.f_code.co_filename).name in IDLE_WAIT_MODULES:
+        frame = frame.f_back
+    return frame is not None and (frame.f_code.co_name, Path(frame.f_code.co_filename).name) in IDLE_WAIT_POINTS
+
+def _function_name(frame: str) -> str:
+    """Drop the line number from a collapsed-stack frame: "f (mod.py:12)" -> "f (mod.py)"."""
+    return re.sub(r":\d+\)$", ")", frame)
+
+def _top_functions(stacks: Counter) -> List[dict]:
+    """
+    Aggregate collapsed stacks into per-function self and total sample counts.
+    Samples from different lines of a function are counted together.
+    """
+    self_counts: Counter = Counter()
+    total_counts: Counter = Counter()
+    for stack, count in stacks.items():
+        frames = [_function_name(frame) for frame in stack.split(";")[1:]]
+        if not frames:
+            continue
+        self_counts[frames[-1]] += count
+        for frame in set(frames):
+            total_counts[frame] += count
+    return [
+        {"function": function, "self_samples": self_counts[function], "total_samples": total}
+        for function, total in total_counts.most_common(TOP_FUNCTIONS)
+    ]
+
+def _start_tracemalloc():
+    with _state.lock:
+        if _state.tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _state.tracemalloc_users += 1
+
+def _stop_tracemalloc() -> List[dict]:
+    try:
+        snapshot = tracemalloc.take_snapshot()
+    finally:
+        with _state.lock:
+            _state.tracemalloc_users -= 1
+            if _state.tracemalloc_users == 0:
+                tracemalloc.stop()
+    return [
+        {"location": str(stat.traceback), "size_kb": round(stat.size / 1024, 1), "count": stat.count}
+        for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]
+    ]
+
+def _prune_reports():
+    reports = sorted(PROFILES_DIR.glob("*.json"), key=lambda p: p.stat().st_mtime)
+    for report in reports[:-MAX_REPORTS]:
+        report.unlink(missing_ok=True)
+        report.with_suffix(".collapsed").unlink(missing_ok=True)
+
+def _save_report(label: str, started_at: datetime, duration_ms: float, sampler: _StackSampler, allocation_stats: Optional[List[dict]]):
+    report_id = f"{started_at:%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}"
+    report = {
+        "id": report_id,
+        "label": label,
+        "started_at": started_at.isoformat(),
+        "duration_ms": round(duration_ms, 1),
+        "interval_ms": SAMPLE_INTERVAL_S * 1000,
+        "samples": sampler.samples,
+        "idle_worker_samples": sampler.idle_samples,  # Parked worker stacks left out of the profile
+        "top_functions": _top_functions(sampler.stacks),
+        "allocations": allocation_stats,
+    }
+
+    PROFILES_DIR.mkdir(exist_ok=True)
+    with open(PROFILES_DIR / f"{report_id}.json", "w") as f:
+        json.dump(report, f, indent=2)
+    with open(PROFILES_DIR / f"{report_id}.collapsed", "w") as f:
+        f.writelines(f"{stack} {count}\n" for stack, count in sampler.stacks.items())
+    _prune_reports()
+    logger.info(f"🔬 Saved profile {report_id} ({duration_ms:.0f}ms, {sampler.samples} samples)")
+
+@contextmanager
+def profile_request(label: str) -> Iterator[_StackSampler]:
+    """Profile the enclosed block and store a report under profiles/."""
+    allocations = _state.allocations
+    sampler = _StackSampler(threading.get_ident())
+    if allocations:
+        _start_tracemalloc()
+    started_at = datetime.now()
+    start = time.perf_counter()
+    sampler.start()
+    try:
+        yield sampler
+    finally:
+        sampler.stop_event.set()
+        sampler.join()
+        duration_ms = (time.perf_counter() - start) * 1000
+        # Saving must never replace the profiled request's own result or error
+        try:
+            allocation_stats = _stop_tracemalloc() if allocations else None
+            _save_report(label, started_at, duration_ms, sampler, allocation_stats)
+        except Exception as e:
+            logger.error(f"❌ Failed to save profile report: {e}")
+
+def profile_stream(label: str, events: Iterator) -> Iterator:
+    """
+    Profile an iterator for its whole lifetime, from the first step until it is
+    exhausted, fails or is closed.
+
+    StreamingResponse runs each step of a sync iterator on a pool thread, so the
+    sampler follows the thread running the current step and samples no request
+    thread while the response waits on the client between steps.
+    """
+    with profile_request(label) as sampler:
+        while True:
+            sampler.request_thread_id = threading.get_ident()
+            try:
+                event = next(events)
+            except StopIteration:
+                return
+            finally:
+                sampler.request_thread_id = None
+            yield event
+
+def list_reports() -> List[dict]:
+    """Summaries of stored reports, newest first."""
+    reports = []
+    for path in sorted(PROFILES_DIR.glob("*.json"), reverse=True):
+        with open(path) as f:
+            report = json.load(f)
+        reports.append({key: report[key] for key in ("id", "label", "started_at", "duration_ms", "samples")})
+    return reports
+
+def get_report_path(report_id: str, fmt: str = "json") -> Optional[Path]:
+    """Path of a stored report ("json" or "collapsed"), or None if it does not exist."""
+    if not REPORT_ID_PATTERN.match(report_id) or fmt not in ("json", "collapsed"):
+        return None
+    path = PROFILES_DIR / f"{report_id}.{fmt}"
+    return path if path.exists() else None
@@ -4,31 +4,56 @@ Pizza Review Vector Store
 ==========================
 
 A semantic search system for pizza restaurant reviews using LangChain and ChromaDB.
+
+Reviews live in one global collection for unfiltered queries, plus one small
+collection per city so city-filtered queries search only that city's HNSW
+graph instead of post-filtering the global one.
+
+The DB directory is a versioned index artifact: index_manifest.json records a
+key built from the CSV content hash, embedding model and collection schema.
+A DB whose key does not match is rebuilt; otherwise it is loaded as-is, so an
+index prebuilt at image build time (`python -m backend.vector`) starts instantly.
+The manifest also holds a digest of each restaurant's reviews, which the query
+cache compares across re-ingests to invalidate only the answers that changed.
 """
 
 import os
+import re
+import json
+import shutil
+import hashlib
+import chromadb
 import pandas as pd
-from typing import Optional, List
+from collections import defaultdict
+from typing import Optional, Iterator, List, Dict
 from langchain_core.documents import Document
-from langchain_huggingface import HuggingFaceEmbeddings
+from backend.embedding_batcher import get_shared_embeddings
 from langchain_chroma import Chroma
 from logger_config import setup_logger
 
 
 # --- Configuration ---
 CSV_PATH = "data/final_israel_pizza_reviews_realistic.csv"
-DB_PATH = "chroma_langchain_db"
+DB_PATH = os.getenv("VECTOR_DB_PATH", "chroma_langchain_db")
 EMBEDDING_MODEL = "BAAI/bge-small-en-v1.5"
 COLLECTION_NAME = "restaurant_reviews"
+SCHEMA_VERSION = 3  # Bump when document IDs, metadata or collection layout change
+PARTITIONS_PATH = os.path.join(DB_PATH, "city_partitions.json")  # exact city → partition collection name
+MANIFEST_PATH = os.path.join(DB_PATH, "index_manifest.json")
 RESULTS_K = 10
 
 # --- Logging ---
 logger = setup_logger(name="vector", log_file="logs/vector.log")
 
 # --- Load embedding model ---
-embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+embeddings = get_shared_embeddings(EMBEDDING_MODEL)  # Shared model, micro-batched across requests
 
 # --- Build vector DB if needed ---
+def _review_id(row) -> str:
+    """Stable review ID derived from the review's content, so rebuilds keep the same IDs."""
+    key = f"{row['Title']}|{row['Date']}|{str(row['City']).strip()}|{row['Review']}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
 def _create_documents_from_csv(csv_path: str) -> List[Document]:
     if not os.path.exists(csv_path):
         logger.error(f"CSV file not found: {csv_path}")
@@ -38,11 +63,18 @@ def _create_documents_from_csv(csv_path: str) -> List[Document]:
     logger.info(f"🧾 Loading {len(df)} pizza reviews from CSV")
 
     docs = []
+    seen_ids = set()
     for i, row in df.iterrows():
         try:
+            review_id = _review_id(row)
+            if review_id in seen_ids:
+                logger.warning(f"⚠️ Skipping duplicate review in row {i}")
+                continue
+            seen_ids.add(review_id)
             doc = Document(
                 page_content=f"{row['Title']} {row['Review']}",
                 metadata={
+                    "review_id": review_id,
                     "rating": float(row["Rating"]),
                     "date": str(row["Date"]),
                     "restaurant": row["Title"],
@@ -56,30 +88,209 @@ def _create_documents_from_csv(csv_path: str) -> List[Document]:
             logger.warning(f"⚠️ Skipping row {i}: {e}")
     return docs
 
-def _create_or_load_vector_store() -> Chroma:
-    if not os.path.exists(DB_PATH):
-        logger.info("📦 Vector DB not found, creating new one...")
-        docs = _create_documents_from_csv(CSV_PATH)
-        return Chroma.from_documents(
-            documents=docs,
-            embedding=embeddings,
-            collection_name=COLLECTION_NAME,
-            persist_directory=DB_PATH
-        )
+def _partition_name(city: str) -> str:
+    """
+    Chroma collection name for a city partition, e.g. 'Tel Aviv' → 'restaurant_reviews_tel_aviv_<hash>'.
+    
+    The hash of the exact city string keeps cities that slugify or truncate alike apart.
+    """
+    slug = re.sub(r"[^a-z0-9]+", "_", city.lower()).strip("_") or "unknown"
+    digest = hashlib.sha1(city.encode("utf-8")).hexdigest()[:8]
+    return f"{f'{COLLECTION_NAME}_{slug}'[:54].rstrip('_')}_{digest}"
+
+def _iter_collection(store: Chroma, include: List[str]) -> Iterator[dict]:
+    """
+    Page through a collection with `limit`/`offset` instead of one unbounded get().
+    
+    Pages are the client's max batch size, so each one can be upserted as is
+    (Chroma rejects larger batches).
+    """
+    page_size = store._client.get_max_batch_size()
+    offset = 0
+    while True:
+        page = store.get(include=include, limit=page_size, offset=offset)
+        if not page["ids"]:
+            return
+        yield page
+        offset += len(page["ids"])
+
+def _build_city_partitions(store: Chroma) -> Dict[str, str]:
+    """
+    Split the global collection into one collection per city.
+    
+    Embeddings are copied from the global collection, so nothing is re-embedded.
+    """
+    collections = {}
+    counts = defaultdict(int)
+    for page in _iter_collection(store, ["embeddings", "documents", "metadatas"]):
+        by_city = defaultdict(list)
+        for i, metadata in enumerate(page["metadatas"]):
+            by_city[str(metadata.get("city", "")).strip()].append(i)
+        
+        for city, indexes in by_city.items():
+            if not city:
+                continue
+            if city not in collections:
+                collections[city] = Chroma(collection_name=_partition_name(city), persist_directory=DB_PATH, embedding_function=embeddings)
+            collections[city]._collection.upsert(
+                ids=[page["ids"][i] for i in indexes],
+                embeddings=[page["embeddings"][i] for i in indexes],
+                documents=[page["documents"][i] for i in indexes],
+                metadatas=[page["metadatas"][i] for i in indexes]
+            )
+            counts[city] += len(indexes)
+    
+    partitions = {city: _partition_name(city) for city in collections}
+    for city, name in partitions.items():
+        logger.info(f"🗂️ Built partition {name} with {counts[city]} reviews")
+    
+    with open(PARTITIONS_PATH, "w") as f:
+        json.dump(partitions, f, indent=2)
+    return partitions
+
+def _load_city_partitions(store: Chroma) -> Dict[str, Chroma]:
+    """Open the per-city partitions, building them first if this DB predates them."""
+    if os.path.exists(PARTITIONS_PATH):
+        with open(PARTITIONS_PATH) as f:
+            partitions = json.load(f)
     else:
-        logger.info("📂 Loading existing vector DB")
-        return Chroma(
-            collection_name=COLLECTION_NAME,
-            persist_directory=DB_PATH,
-            embedding_function=embeddings
-        )
-
-# --- Shared store instance ---
+        logger.info("🗂️ City partitions not found, building from global collection...")
+        partitions = _build_city_partitions(store)
+    
+    logger.info(f"🗂️ Loaded {len(partitions)} city partitions")
+    return {
+        city: Chroma(collection_name=name, persist_directory=DB_PATH, embedding_function=embeddings)
+        for city, name in partitions.items()
+    }
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _index_key() -> Dict[str, str]:
+    """Everything that determines the index contents; any change forces a rebuild."""
+    return {
+        "csv_sha256": _file_sha256(CSV_PATH),
+        "embedding_model": EMBEDDING_MODEL,
+        "collection": COLLECTION_NAME,
+        "schema_version": str(SCHEMA_VERSION),
+        "chromadb_version": chromadb.__version__,
+    }
+
+def _index_version(key: Dict[str, str]) -> str:
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+def _read_manifest() -> Optional[dict]:
+    if not os.path.exists(MANIFEST_PATH):
+        return None
+    with open(MANIFEST_PATH) as f:
+        return json.load(f)
+
+def _restaurant_digests(contents: List[str], metadatas: List[dict]) -> Dict[str, str]:
+    """
+    Digest of each restaurant's reviews, keyed "city|restaurant".
+    
+    Covers every review's text and full metadata, so adding, removing or editing
+    any review (including its rating, state or categories) changes the digest.
+    """
+    reviews = defaultdict(list)
+    for content, metadata in zip(contents, metadatas):
+        key = f"{str(metadata.get('city', '')).strip()}|{metadata.get('restaurant', '')}"
+        reviews[key].append(json.dumps([content, metadata], sort_keys=True, default=str))
+    return {
+        key: hashlib.sha1("\n".join(sorted(items)).encode("utf-8")).hexdigest()[:16]
+        for key, items in reviews.items()
+    }
+
+def build_index(key: Dict[str, str]) -> Chroma:
+    """
+    Build the global collection and city partitions from the CSV into DB_PATH.
+    
+    The manifest is written last, so an interrupted build is rebuilt on next start.
+    """
+    if os.path.exists(DB_PATH):
+        logger.info(f"🧹 Removing outdated vector DB at {DB_PATH}")
+        shutil.rmtree(DB_PATH)
+    
+    docs = _create_documents_from_csv(CSV_PATH)
+    store = Chroma.from_documents(
+        documents=docs,
+        ids=[doc.metadata["review_id"] for doc in docs],
+        embedding=embeddings,
+        collection_name=COLLECTION_NAME,
+        persist_directory=DB_PATH
+    )
+    _build_city_partitions(store)
+    
+    manifest = {
+        "version": _index_version(key),
+        "key": key,
+        "documents": len(docs),
+        "restaurants": _restaurant_digests([doc.page_content for doc in docs], [doc.metadata for doc in docs]),
+    }
+    with open(MANIFEST_PATH, "w") as f:
+        json.dump(manifest, f, indent=2)
+    logger.info(f"📦 Built vector index {manifest['version']} with {len(docs)} reviews")
+    return store
+
+def _create_or_load_vector_store() -> Chroma:
+    key = _index_key()
+    manifest = _read_manifest()
+    
+    if manifest is None:
+        logger.info("📦 Vector DB not found or unversioned, building a new one...")
+        return build_index(key)
+    if manifest.get("key") != key:
+        changed = [name for name in key if manifest.get("key", {}).get(name) != key[name]]
+        logger.info(f"📦 Vector DB {manifest.get('version')} is outdated ({', '.join(changed)} changed), rebuilding...")
+        return build_index(key)
+    
+    logger.info(f"📂 Loading vector DB {manifest['version']}")
+    return Chroma(
+        collection_name=COLLECTION_NAME,
+        persist_directory=DB_PATH,
+        embedding_function=embeddings
+    )
+
+def get_index_manifest() -> dict:
+    """Manifest of the loaded index (version, key, document count)."""
+    return _read_manifest()
+
+def get_restaurant_digests() -> Dict[str, str]:
+    """Per-restaurant review digests of the loaded index, for targeted cache invalidation."""
+    manifest = _read_manifest() or {}
+    if "restaurants" in manifest:
+        return manifest["restaurants"]
+    # Index built before digests were recorded
+    contents, metadatas = [], []
+    for page in _iter_collection(vector_store, ["documents", "metadatas"]):
+        contents.extend(page["documents"])
+        metadatas.extend(page["metadatas"])
+    return _restaurant_digests(contents, metadatas)
+
+# --- Shared store instances ---
 vector_store = _create_or_load_vector_store()
+city_stores = _load_city_partitions(vector_store)
 
 # --- Main retriever function ---
 def get_retriever(city: Optional[str] = None):
+    """
+    Get a retriever for the query's city.
+    
+    Cities with a partition are searched directly in it; unknown cities fall back
+    to a metadata filter on the global collection, and no city searches globally.
+    """
     search_kwargs = {"k": RESULTS_K}
+    # Keyed by the exact city string, matching what the metadata filter would select
+    if city and city.strip() in city_stores:
+        logger.info(f"🌍 Routing to city partition: {city.strip()}")
+        retriever = city_stores[city.strip()].as_retriever(search_kwargs=search_kwargs)
+        logger.info(f"🔍 Retriever created with: {search_kwargs}")
+        return retriever
+
     if city:
         search_kwargs["filter"] = {"city": city.strip()}
         logger.info(f"🌍 Filtering by city: {city.strip()}")
@@ -89,3 +300,7 @@ def get_retriever(city: Optional[str] = None):
     retriever = vector_store.as_retriever(search_kwargs=search_kwargs)
     logger.info(f"🔍 Retriever created with: {search_kwargs}")
     return retriever
+
+if __name__ == "__main__":
+    # Importing the module validates or (re)builds the index; used as the image build step
+    print(json.dumps(get_index_manifest(), indent=2))
@@ -0,0 +1,99 @@
+# benchmark_retrieval.py
+"""
+Compare city-filtered retrieval on the global collection (metadata filter)
+against the per-city partitions built by backend/vector.py.
+
+For every city and sample query it measures search latency (query embedding
+excluded) and recall@k against an exact brute-force search over that city's
+reviews.
+
+Usage:
+    python benchmark_retrieval.py --repeats 20
+"""
+
+import argparse
+import statistics
+import time
+import numpy as np
+from backend.vector import vector_store, city_stores, embeddings, RESULTS_K
+
+SAMPLE_QUERIES = [
+    "I had the best pizza experience here.",
+    "I'm looking for pizza places with the crispiest crust.",
+    "Authentic Neapolitan pizza with a great dough.",
+    "The toppings were spicy and fresh.",
+    "The pizza arrived cold and the service was slow.",
+]
+
+def exact_top_k(query_embedding: np.ndarray, city: str, k: int) -> set:
+    """Ground truth: brute-force L2 search over all reviews of a city."""
+    data = vector_store.get(where={"city": city}, include=["embeddings"])
+    if not data["ids"]:
+        return set()
+    distances = np.linalg.norm(np.asarray(data["embeddings"]) - query_embedding, axis=1)
+    return {data["ids"][i] for i in np.argsort(distances)[:k]}
+
+def timed_search(search, repeats: int):
+    """Run a search repeatedly, returning (median latency ms, result ids)."""
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        docs = search()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return statistics.median(latencies), {doc.id for doc in docs}
+
+def run(repeats: int, k: int):
+    cities = {doc["city"] for doc in vector_store.get(include=["metadatas"])["metadatas"]}
+    print(f"\n📏 Retrieval benchmark (k={k}, {repeats} repeats, median latency)")
+    print("=" * 72)
+    print(f"{'City':<16}{'Filtered ms':>12}{'Partition ms':>14}{'Filtered recall':>17}{'Partition recall':>18}")
+
+    totals = {"filtered_ms": [], "partition_ms": [], "filtered_recall": [], "partition_recall": []}
+    for city in sorted(cities):
+        partition = city_stores.get(city)
+        if partition is None:
+            print(f"{city:<16}  (no partition)")
+            continue
+
+        row = {key: [] for key in totals}
+        for query in SAMPLE_QUERIES:
+            query_embedding = embeddings.embed_query(query)
+            truth = exact_top_k(np.asarray(query_embedding), city, k)
+
+            filtered_ms, filtered_ids = timed_search(
+                lambda: vector_store.similarity_search_by_vector(query_embedding, k=k, filter={"city": city}),
+                repeats
+            )
+            partition_ms, partition_ids = timed_search(
+                lambda: partition.similarity_search_by_vector(query_embedding, k=k),
+                repeats
+            )
+
+            row["filtered_ms"].append(filtered_ms)
+            row["partition_ms"].append(partition_ms)
+            row["filtered_recall"].append(len(filtered_ids & truth) / len(truth) if truth else 1.0)
+            row["partition_recall"].append(len(partition_ids & truth) / len(truth) if truth else 1.0)
+
+        means = {key: statistics.mean(values) for key, values in row.items()}
+        for key in totals:
+            totals[key].append(means[key])
+        print(
+            f"{city:<16}{means['filtered_ms']:>12.2f}{means['partition_ms']:>14.2f}"
+            f"{means['filtered_recall']:>17.2f}{means['partition_recall']:>18.2f}"
+        )
+
+    if totals["filtered_ms"]:
+        print("-" * 72)
+        print(
+            f"{'Average':<16}{statistics.mean(totals['filtered_ms']):>12.2f}"
+            f"{statistics.mean(totals['partition_ms']):>14.2f}"
+            f"{statistics.mean(totals['filtered_recall']):>17.2f}"
+            f"{statistics.mean(totals['partition_recall']):>18.2f}"
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark city-filtered vs partitioned retrieval")
+    parser.add_argument("--repeats", type=int, default=20, help="Searches per query for latency")
+    parser.add_argument("-k", type=int, default=RESULTS_K, help="Results per search")
+    args = parser.parse_args()
+    run(args.repeats, args.k)
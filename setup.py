@@ -17,6 +17,7 @@ setup(
         "requests",
         "python-dotenv",
         "pydantic>=2.0.0",
+        "orjson",
     ],
     extras_require={
         "dev": [
@@ -0,0 +1,4 @@
+from pathlib import Path
+
+# Backend modules log to logs/<name>.log relative to the working directory
+Path("logs").mkdir(exist_ok=True)
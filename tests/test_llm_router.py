@@ -0,0 +1,119 @@
+import asyncio
+import time
+
+import pytest
+from langchain_core.runnables import RunnableLambda
+
+from backend import llm_router
+from backend.admission import OverloadedError, _controllers
+from backend.llm_router import HedgedLLM, get_backend_stats
+
+
+def answering(text, delay_s=0.0, cancelled=None):
+    """Stub backend answering after delay_s, recording in `cancelled` if it was cancelled."""
+    async def call(_input):
+        try:
+            await asyncio.sleep(delay_s)
+        except asyncio.CancelledError:
+            if cancelled is not None:
+                cancelled.append(text)
+            raise
+        return text
+    return RunnableLambda(call)
+
+
+def failing(error):
+    async def call(_input):
+        raise error
+    return RunnableLambda(call)
+
+
+@pytest.fixture
+def short_budget(monkeypatch):
+    monkeypatch.setattr(llm_router, "HEDGE_BUDGET_S", 0.05)
+
+
+def test_hedge_wins_and_slow_primary_is_cancelled(short_budget):
+    cancelled = []
+    router = HedgedLLM(
+        {"slow-a": answering("slow", delay_s=5, cancelled=cancelled), "fast-a": answering("fast")},
+        primary="slow-a",
+        use_admission=False,
+    )
+
+    start = time.monotonic()
+    assert router.invoke("prompt") == "fast"
+    assert time.monotonic() - start < 1
+    assert cancelled == ["slow"]
+    assert get_backend_stats("fast-a").hedge_wins == 1
+    assert get_backend_stats("slow-a").errors == 0
+
+
+def test_fast_primary_is_not_hedged():
+    router = HedgedLLM(
+        {"fast-b": answering("primary"), "spare-b": answering("secondary")},
+        primary="fast-b",
+        use_admission=False,
+    )
+
+    assert router.invoke("prompt") == "primary"
+    assert get_backend_stats("spare-b").hedges_sent == 0
+
+
+def test_error_fails_over_without_waiting_for_budget():
+    router = HedgedLLM(
+        {"broken-c": failing(RuntimeError("boom")), "ok-c": answering("failover")},
+        primary="broken-c",
+        use_admission=False,
+    )
+
+    start = time.monotonic()
+    assert router.invoke("prompt") == "failover"
+    assert time.monotonic() - start < llm_router.HEDGE_BUDGET_S
+    assert get_backend_stats("broken-c").errors == 1
+
+
+def test_both_overloaded_raises_overloaded_error():
+    router = HedgedLLM(
+        {
+            "busy-d": failing(OverloadedError("busy-d", "queue full", 1)),
+            "busy-e": failing(OverloadedError("busy-e", "queue full", 2)),
+        },
+        primary="busy-d",
+        use_admission=False,
+    )
+
+    with pytest.raises(OverloadedError):
+        router.invoke("prompt")
+
+
+def test_other_errors_win_over_overload():
+    router = HedgedLLM(
+        {"busy-f": failing(OverloadedError("busy-f", "queue full", 1)), "broken-f": failing(ValueError("bad"))},
+        primary="busy-f",
+        use_admission=False,
+    )
+
+    with pytest.raises(ValueError):
+        router.invoke("prompt")
+
+
+def test_loser_releases_its_admission_slot(short_budget):
+    router = HedgedLLM(
+        {"local": answering("slow", delay_s=5), "cloud": answering("fast")},
+        primary="local",
+    )
+
+    assert router.invoke("prompt") == "fast"
+    assert _controllers["local"].stats().in_flight == 0
+    assert _controllers["cloud"].stats().in_flight == 0
+
+
+def test_ainvoke_races_on_the_callers_loop(short_budget):
+    router = HedgedLLM(
+        {"slow-g": answering("slow", delay_s=5), "fast-g": answering("fast")},
+        primary="slow-g",
+        use_admission=False,
+    )
+
+    assert asyncio.run(router.ainvoke("prompt")) == "fast"